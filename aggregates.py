@@ -0,0 +1,379 @@
+import bisect
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.time_utils import to_timezone, local_times
+
+# Bump this whenever the layout of the store changes so stale cached stores get rebuilt
+AGGREGATES_VERSION = 3
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Time-of-day bins (hour boundaries, left-inclusive) and their labels
+TIME_BINS = [0, 9, 12, 16, 20, 24]
+TIME_LABELS = [
+    'Early Morning (4 AM - 9 AM)',
+    'Late Morning (9 AM - 12 PM)',
+    'Afternoon (12 PM - 4 PM)',
+    'Evening (4 PM - 8 PM)',
+    'Night (8 PM - 4 AM)'
+]
+
+
+def new_aggregates():
+    """Return an empty per-user aggregate store.
+
+    Every bucket holds a running [sum, count] of moods. The "latest" trackers hold
+    [date, sum, count] for the most recent date seen in that bucket. All buckets use
+    the entry's local wall-clock time in its own timezone.
+    """
+    return {
+        'version': AGGREGATES_VERSION,
+        'count': 0,
+        'latest_timezone': None,
+        'days': {},    # 'YYYY-MM-DD' -> [sum, count], backs the date-range index
+        'months': {},  # 'YYYY-MM-01' -> [sum, count]
+        'weeks': {},   # Monday of the week, 'YYYY-MM-DD' -> [sum, count]
+        'weekdays': [[0.0, 0] for _ in DAY_ORDER],
+        'weekday_latest': [[None, 0.0, 0] for _ in DAY_ORDER],
+        'times': [[0.0, 0] for _ in TIME_LABELS],
+        'time_latest': [[None, 0.0, 0] for _ in TIME_LABELS],
+        'today': [None, 0.0, 0],  # Latest local day seen
+    }
+
+
+def _time_bin(hour):
+    """Index of the time-of-day bin an hour falls into."""
+    return bisect.bisect_right(TIME_BINS, hour) - 1
+
+
+def _add(bucket, mood):
+    bucket[0] += mood
+    bucket[1] += 1
+
+
+def _add_latest(tracker, day, mood):
+    # Days are ISO strings, so string comparison orders them correctly
+    if tracker[0] is None or day > tracker[0]:
+        tracker[:] = [day, mood, 1]
+    elif day == tracker[0]:
+        tracker[1] += mood
+        tracker[2] += 1
+
+
+def _local_date(date, timezone):
+    """A UTC entry date (naive dates are taken as UTC) as naive wall-clock time in the entry's timezone."""
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        date = date.tz_localize('UTC')
+    return date.tz_convert(to_timezone(timezone)).tz_localize(None)
+
+
+def _periods(day):
+    """Month and week (Monday) keys of a local day."""
+    return day.strftime('%Y-%m-01'), (day - pd.Timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+
+
+def entry_periods(date, timezone):
+    """Month and week keys an entry is bucketed under."""
+    return _periods(_local_date(date, timezone))
+
+
+def open_periods(aggregates):
+    """Month and week keys of the latest local day in the store: the periods new entries still land in."""
+    if aggregates['today'][0] is None:
+        return None, None
+    return _periods(pd.Timestamp(aggregates['today'][0]))
+
+
+def local_today(aggregates):
+    """The current date in the user's timezone (UTC without entries), which decides what "today" is in the quick stats."""
+    return datetime.now(to_timezone(aggregates['latest_timezone'])).strftime('%Y-%m-%d')
+
+
+def update_aggregates(aggregates, date, mood, timezone):
+    """Fold a single mood entry (UTC date plus its timezone) into the aggregate store in O(1)."""
+    date = _local_date(date, timezone)
+    mood = float(mood)
+    day = date.strftime('%Y-%m-%d')
+
+    _add(aggregates['days'].setdefault(day, [0.0, 0]), mood)
+    month, week_start = _periods(date)
+    _add(aggregates['months'].setdefault(month, [0.0, 0]), mood)
+    _add(aggregates['weeks'].setdefault(week_start, [0.0, 0]), mood)
+
+    weekday = date.weekday()
+    _add(aggregates['weekdays'][weekday], mood)
+    _add_latest(aggregates['weekday_latest'][weekday], day, mood)
+
+    time_bin = _time_bin(date.hour)
+    _add(aggregates['times'][time_bin], mood)
+    _add_latest(aggregates['time_latest'][time_bin], day, mood)
+
+    _add_latest(aggregates['today'], day, mood)
+
+    aggregates['count'] += 1
+    aggregates['latest_timezone'] = timezone
+    return aggregates
+
+
+def _latest(totals, key):
+    """Per key, the [date, sum, count] of the most recent day in a day-level totals table."""
+    latest = totals.loc[totals.groupby(key)['day'].idxmax()]
+    return {k: [day.strftime('%Y-%m-%d'), float(total), int(count)]
+            for k, day, total, count in zip(latest[key], latest['day'], latest['sum'], latest['count'])}
+
+
+def build_aggregates(df):
+    """Build the aggregate store from a user's full set of mood rows in a single vectorized pass.
+
+    The rows are grouped once by (day, time-of-day bin); every other bucket is a
+    function of the day, so months, weeks, weekdays and the latest-date trackers
+    are rolled up from that small table instead of regrouping the raw rows.
+    The caller's frame is never modified.
+    """
+    aggregates = new_aggregates()
+    if df.empty:
+        return aggregates
+
+    # Bucket every row by its own local time, converting one timezone at a time
+    dates = df['date']
+    if dates.dt.tz is None:
+        dates = dates.dt.tz_localize('UTC')
+    dates = local_times(dates, df['timezone'])
+    moods = df['mood'].astype(float)
+    totals = pd.DataFrame({
+        'day': dates.dt.normalize(),
+        'time_bin': np.searchsorted(TIME_BINS, dates.dt.hour, side='right') - 1,
+        'mood': moods
+    }).groupby(['day', 'time_bin'])['mood'].agg(['sum', 'count']).reset_index()
+
+    day_totals = totals.groupby('day')[['sum', 'count']].sum().reset_index()
+    day_totals['weekday'] = day_totals['day'].dt.weekday
+
+    aggregates['days'] = {day.strftime('%Y-%m-%d'): [float(total), int(count)]
+                          for day, total, count in zip(day_totals['day'], day_totals['sum'], day_totals['count'])}
+    months = day_totals.groupby(day_totals['day'].dt.strftime('%Y-%m-01'))[['sum', 'count']].sum()
+    week_starts = day_totals['day'] - pd.to_timedelta(day_totals['weekday'], unit='d')
+    weeks = day_totals.groupby(week_starts.dt.strftime('%Y-%m-%d'))[['sum', 'count']].sum()
+    aggregates['months'] = {k: [float(total), int(count)] for k, total, count in zip(months.index, months['sum'], months['count'])}
+    aggregates['weeks'] = {k: [float(total), int(count)] for k, total, count in zip(weeks.index, weeks['sum'], weeks['count'])}
+
+    weekdays = day_totals.groupby('weekday')[['sum', 'count']].sum()
+    for weekday, total, count in zip(weekdays.index, weekdays['sum'], weekdays['count']):
+        aggregates['weekdays'][weekday] = [float(total), int(count)]
+    for weekday, tracker in _latest(day_totals, 'weekday').items():
+        aggregates['weekday_latest'][weekday] = tracker
+
+    times = totals.groupby('time_bin')[['sum', 'count']].sum()
+    for time_bin, total, count in zip(times.index, times['sum'], times['count']):
+        aggregates['times'][time_bin] = [float(total), int(count)]
+    for time_bin, tracker in _latest(totals, 'time_bin').items():
+        aggregates['time_latest'][time_bin] = tracker
+
+    # Latest local day, for "today's mood"
+    latest_day = day_totals.loc[day_totals['day'].idxmax()]
+    aggregates['today'] = [latest_day['day'].strftime('%Y-%m-%d'), float(latest_day['sum']), int(latest_day['count'])]
+
+    aggregates['count'] = int(len(df))
+    aggregates['latest_timezone'] = df['timezone'].iloc[-1]
+    return aggregates
+
+
+def aggregate_frame(df):
+    """Aggregation engine: every table the dashboard figures need, straight from a frame of mood rows."""
+    return aggregate_tables(build_aggregates(df))
+
+
+def history_summary(aggregates):
+    """The stable part of the summary: averages for the months and weeks before the open ones.
+
+    A new entry only lands in these if it is backdated (e.g. after a timezone change),
+    so this can be cached across submits as long as open_periods hasn't moved.
+    """
+    current_month, current_week = open_periods(aggregates)
+    months = sorted((k, v) for k, v in aggregates['months'].items() if current_month is None or k < current_month)
+    weeks = sorted((k, v) for k, v in aggregates['weeks'].items() if current_week is None or k < current_week)
+    return {
+        'current_month': current_month,
+        'current_week': current_week,
+        'monthly': {
+            'Month Start': [month for month, _ in months],
+            'mood': [total / count for _, (total, count) in months]
+        },
+        'weekly': {
+            'Week Start': [week for week, _ in weeks],
+            'mood': [total / count for _, (total, count) in weeks]
+        }
+    }
+
+
+def current_summary(aggregates, history):
+    """The volatile part of the summary, which every new entry changes.
+
+    Quick stats, the open month and week, and the day-of-week and time-of-day bars,
+    all read from a handful of buckets in O(1).
+    """
+    month = aggregates['months'].get(history['current_month'])
+    week = aggregates['weeks'].get(history['current_week'])
+
+    # Only the weekdays and time bins that have entries get a bar
+    days = [i for i, (_, count) in enumerate(aggregates['weekdays']) if count]
+    times = [i for i, (_, count) in enumerate(aggregates['times']) if count]
+
+    monthly_moods = history['monthly']['mood'] + ([month[0] / month[1]] if month else [])
+    return {
+        # The open periods this was computed against, to check it still lines up with a cached history
+        'current_month': history['current_month'],
+        'current_week': history['current_week'],
+        # The local date the quick stats were computed on, so a copy cached before midnight isn't served after it
+        'today': local_today(aggregates),
+        'stats': summary_from_aggregates(aggregates, monthly_moods),
+        'monthly': {
+            'Month Start': [history['current_month']] if month else [],
+            'mood': [month[0] / month[1]] if month else []
+        },
+        'weekly': {
+            'Week Start': [history['current_week']] if week else [],
+            'mood': [week[0] / week[1]] if week else []
+        },
+        'day_of_week': {
+            'Day': [DAY_ORDER[i] for i in days],
+            'mood_weekly_avg': [aggregates['weekdays'][i][0] / aggregates['weekdays'][i][1] for i in days],
+            'mood_latest_avg': [aggregates['weekday_latest'][i][1] / aggregates['weekday_latest'][i][2] for i in days],
+            'day_only': [aggregates['weekday_latest'][i][0] for i in days]
+        },
+        'time_of_day': {
+            'Time of Day': [TIME_LABELS[i] for i in times],
+            'mood_all_time_avg': [aggregates['times'][i][0] / aggregates['times'][i][1] for i in times],
+            'mood_latest_avg': [aggregates['time_latest'][i][1] / aggregates['time_latest'][i][2] for i in times],
+            'date_only': [aggregates['time_latest'][i][0] for i in times]
+        }
+    }
+
+
+def merge_summaries(history, current):
+    """Join the stable and volatile parts back into one summary."""
+    return {
+        'stats': current['stats'],
+        'monthly': {k: history['monthly'][k] + current['monthly'][k] for k in ('Month Start', 'mood')},
+        'weekly': {k: history['weekly'][k] + current['weekly'][k] for k in ('Week Start', 'mood')},
+        'day_of_week': current['day_of_week'],
+        'time_of_day': current['time_of_day']
+    }
+
+
+def summarize_aggregates(aggregates):
+    """Reduce the aggregate store to the per-figure averages, as plain JSON-friendly lists.
+
+    The graph cache stores this in two parts, history_summary and current_summary;
+    tables_from_summary turns it back into the DataFrames the figure builders take.
+    """
+    history = history_summary(aggregates)
+    return merge_summaries(history, current_summary(aggregates, history))
+
+
+def tables_from_summary(summary):
+    """Turn a summary from summarize_aggregates into the small tables the dashboard figures are built from."""
+    monthly = pd.DataFrame(summary['monthly'])
+    monthly['Month Start'] = pd.to_datetime(monthly['Month Start'])
+
+    weekly = pd.DataFrame(summary['weekly'])
+    weekly['Week Start'] = pd.to_datetime(weekly['Week Start']).dt.date
+
+    day_of_week = pd.DataFrame(summary['day_of_week'])
+    day_of_week['Day'] = pd.Categorical(day_of_week['Day'], categories=DAY_ORDER, ordered=True)
+    day_of_week['day_only'] = pd.to_datetime(day_of_week['day_only']).dt.date
+
+    time_of_day = pd.DataFrame(summary['time_of_day'])
+    time_of_day['Time of Day'] = pd.Categorical(time_of_day['Time of Day'], categories=TIME_LABELS, ordered=True)
+    time_of_day['date_only'] = pd.to_datetime(time_of_day['date_only']).dt.date
+
+    return {
+        'stats': summary['stats'],
+        'monthly': monthly,
+        'weekly': weekly,
+        'day_of_week': day_of_week,
+        'time_of_day': time_of_day
+    }
+
+
+def aggregate_tables(aggregates):
+    """Turn the aggregate store into the small tables the dashboard figures are built from."""
+    return tables_from_summary(summarize_aggregates(aggregates))
+
+
+def day_index(aggregates):
+    """Array-backed index over the store's per-day totals, for date-range queries.
+
+    'days' holds the sorted local days with entries; 'sums' and 'counts' are prefix
+    sums with a leading zero, so the totals for days[i:j] are sums[j] - sums[i].
+    """
+    days = sorted(aggregates['days'].items())
+    return {
+        'days': np.array([day for day, _ in days], dtype='datetime64[D]'),
+        'sums': np.concatenate([[0.0], np.cumsum([total for _, (total, _) in days], dtype=float)]),
+        'counts': np.concatenate([[0], np.cumsum([count for _, (_, count) in days], dtype=np.int64)])
+    }
+
+
+def _range_totals(index, boundaries):
+    """Sums and counts between consecutive day boundaries, one searchsorted call for all of them."""
+    positions = np.searchsorted(index['days'], boundaries, side='left')
+    return np.diff(index['sums'][positions]), np.diff(index['counts'][positions])
+
+
+def range_totals(index, start, end):
+    """Sum and count of moods on the local days start..end (inclusive), in O(log n). Empty if start > end."""
+    if np.datetime64(start, 'D') > np.datetime64(end, 'D'):
+        return 0.0, 0
+    sums, counts = _range_totals(index, np.array([start, np.datetime64(end, 'D') + 1], dtype='datetime64[D]'))
+    return float(sums[0]), int(counts[0])
+
+
+def range_series(index, start, end, freq):
+    """Average mood per month ('M') or week ('W') over the local days start..end, in O(bins log n).
+
+    Returns a table shaped like tables_from_summary's 'monthly' or 'weekly'; the first
+    and last bins only cover the part of their period inside the range, which is empty
+    if start > end.
+    """
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1
+    if start >= end:
+        # An inverted range (e.g. while the date picker is mid-edit) covers no days
+        labels, moods = np.array([], dtype='datetime64[D]'), np.array([], dtype=float)
+    else:
+        if freq == 'M':
+            labels = np.arange(start.astype('datetime64[M]'), (end - 1).astype('datetime64[M]') + 1).astype('datetime64[D]')
+        else:
+            # Day 0 (1970-01-01) was a Thursday, so this is the Monday on or before start
+            first_monday = start - (start.astype(np.int64) + 3) % 7
+            labels = np.arange(first_monday, end, 7)
+
+        boundaries = np.concatenate([[start], labels[1:], [end]]).astype('datetime64[D]')
+        sums, counts = _range_totals(index, boundaries)
+        has_entries = counts > 0
+        labels, moods = labels[has_entries], sums[has_entries] / counts[has_entries]
+    labels = pd.to_datetime(labels)
+    if freq == 'M':
+        return pd.DataFrame({'Month Start': labels, 'mood': moods})
+    return pd.DataFrame({'Week Start': labels.date, 'mood': moods})
+
+
+def summary_from_aggregates(aggregates, monthly_moods):
+    """Compute the quick stats (today's mood, baseline, entry counts) from the store."""
+    today = local_today(aggregates)
+
+    latest_day, today_total, today_count = aggregates['today']
+    if latest_day != today:
+        today_total, today_count = 0.0, 0
+
+    return {
+        'today_mood': today_total / today_count if today_count else "No entries today",
+        # EMA of monthly averages
+        'baseline_mood': float(pd.Series(monthly_moods).ewm(alpha=0.3).mean().iloc[-1]) if aggregates['count'] else "No data",
+        'mood_entries_today': today_count,
+        'mood_entries_all_time': aggregates['count']
+    }
@@ -0,0 +1,84 @@
+"""Benchmark the dashboard aggregation engine against the old per-figure pipeline.
+
+Run from the repo root:  python benchmarks/bench_aggregation.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregates import aggregate_frame, new_aggregates, update_aggregates, aggregate_tables
+
+SIZES = [10_000, 100_000, 1_000_000]
+ROW_FOLD_MAX = 100_000  # Folding row by row is too slow to be worth timing past this
+
+
+def make_frame(n, seed=0):
+    """Synthetic mood history spread over ~3 years, shaped like load_data's output."""
+    rng = np.random.default_rng(seed)
+    minutes = np.sort(rng.integers(0, 3 * 365 * 24 * 60, n))
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'date': pd.Timestamp('2022-01-01') + pd.to_timedelta(minutes, unit='m'),
+        'mood': rng.integers(10, 101, n) / 10,
+        'description': 'benchmark',
+        'timezone': 'America/New_York'
+    })
+
+
+def legacy_tables(df):
+    """The aggregation half of the old generate_* functions, one groupby pass per figure."""
+    df['Month Start'] = df['date'].dt.to_period('M').dt.to_timestamp()
+    monthly = df.groupby('Month Start')['mood'].mean().reset_index()
+    # generate_summary_statistics regrouped the months a second time
+    df.groupby('Month Start')['mood'].mean().reset_index()
+
+    df['Week Start'] = (df['date'] - pd.to_timedelta(df['date'].dt.weekday, unit='d')).dt.date
+    weekly = df.groupby('Week Start')['mood'].mean().reset_index()
+
+    df['day_only'] = df['date'].dt.date
+    df['Day'] = df['day_only'].apply(lambda x: x.strftime('%A'))
+    day_mood_avg = df.groupby('Day')['mood'].mean().reset_index()
+    latest_mood_per_day = df.sort_values('date', ascending=False).groupby('Day').head(1)
+    recent = df[df['day_only'].isin(latest_mood_per_day['day_only'])].groupby(['Day'])['mood'].mean().reset_index()
+    day_of_week = pd.merge(day_mood_avg, recent, on='Day', how='left', suffixes=('_weekly_avg', '_latest_avg'))
+
+    df['date_only'] = df['date'].dt.date
+    df['Time of Day'] = pd.cut(df['date'].dt.hour, bins=[0, 9, 12, 16, 20, 24], labels=False, right=False)
+    time_mood_avg = df.groupby('Time of Day')['mood'].mean().reset_index()
+    latest_dates = df.groupby('Time of Day')['date_only'].max().reset_index()
+    latest = pd.merge(df, latest_dates, on=['Time of Day', 'date_only'], how='inner')
+    latest_avg = latest.groupby('Time of Day').agg({'mood': 'mean', 'date_only': 'max'}).reset_index()
+    time_of_day = pd.merge(time_mood_avg, latest_avg, on='Time of Day', how='left')
+
+    return monthly, weekly, day_of_week, time_of_day
+
+
+def row_fold_tables(df):
+    aggregates = new_aggregates()
+    for date, mood, timezone in zip(df['date'], df['mood'], df['timezone']):
+        update_aggregates(aggregates, date, mood, timezone)
+    return aggregate_tables(aggregates)
+
+
+def timed(func, df, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        frame = df.copy()  # The legacy pipeline mutates its input
+        start = time.perf_counter()
+        func(frame)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    print(f"{'rows':>10} {'legacy (s)':>12} {'row fold (s)':>14} {'engine (s)':>12} {'speedup':>9}")
+    for n in SIZES:
+        df = make_frame(n)
+        legacy = timed(legacy_tables, df)
+        fold = timed(row_fold_tables, df, repeat=1) if n <= ROW_FOLD_MAX else float('nan')
+        engine = timed(aggregate_frame, df)
+        print(f"{n:>10} {legacy:>12.3f} {fold:>14.3f} {engine:>12.3f} {legacy / engine:>8.1f}x")
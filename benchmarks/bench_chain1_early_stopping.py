@@ -0,0 +1,71 @@
+"""Benchmark CHAIN 1's adaptive early stopping against recorded runs.
+
+Replays the fixture runs in benchmarks/fixtures/chain1_runs.json (10 per day) and
+compares the adaptive mode with always running the cap, min(3 * rows, 10).
+Quality is measured as consensus coverage: of the (category, impact direction,
+keyword) claims at least half of the capped runs agree on, the share that the
+adaptive runs still hand to the consolidation step.
+
+Run from the repo root:  python benchmarks/bench_chain1_early_stopping.py
+"""
+import json
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.run_agreement import parse_run, run_signature, sample_until_agreement
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'chain1_runs.json')
+THRESHOLDS = [0.5, 0.6, 0.7]
+
+
+def claims(content):
+    return {(category, direction, keyword) for category, direction, keywords in run_signature(parse_run(content)) or ()
+            for keyword in keywords}
+
+
+def consensus(contents):
+    """Claims made by at least half of the runs."""
+    counts = Counter(claim for content in contents for claim in claims(content))
+    return {claim for claim, count in counts.items() if count >= len(contents) / 2}
+
+
+def coverage(contents, expected):
+    found = set().union(*(claims(content) for content in contents))
+    return len(found & expected) / len(expected) if expected else 1.0
+
+
+def replay(runs):
+    """A sample(n, drawn) that hands out the recorded runs in order, counting requests."""
+    state = {'requests': 0}
+    def sample(n, drawn):
+        state['requests'] += 1
+        return runs[drawn:drawn + n]
+    return sample, state
+
+
+def tokens(contents):
+    # Rough output-token count, ~4 characters per token
+    return sum(len(content) for content in contents) // 4
+
+
+if __name__ == '__main__':
+    with open(FIXTURES, encoding='utf-8') as file:
+        fixtures = json.load(file)
+
+    for threshold in THRESHOLDS:
+        print(f"\nagreement threshold {threshold}")
+        print(f"{'day':>20} {'cap':>4} {'runs':>5} {'requests':>9} {'tokens':>14} {'consensus coverage':>19}")
+        total_full = total_adaptive = 0
+        for name, day in fixtures.items():
+            cap = min(3 * day['rows'], 10)
+            full = day['runs'][:cap]
+            sample, state = replay(day['runs'])
+            adaptive = sample_until_agreement(sample, cap, threshold=threshold)
+            total_full += tokens(full)
+            total_adaptive += tokens(adaptive)
+            print(f"{name:>20} {cap:>4} {len(adaptive):>5} {state['requests']:>9} "
+                  f"{tokens(adaptive):>6} / {tokens(full):>5} {coverage(adaptive, consensus(full)):>19.2f}")
+        print(f"{'total':>20} {'':>4} {'':>5} {'':>9} {total_adaptive:>6} / {total_full:>5} "
+              f"({1 - total_adaptive / total_full:.0%} fewer output tokens)")
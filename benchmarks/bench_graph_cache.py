@@ -0,0 +1,82 @@
+"""Benchmark the graph cache's packed summaries against the old pickled figures.
+
+The old graphs_cache_{uuid} entry was the pickled output of generate_all_graphs: the
+quick-stats Dash component and four full Plotly figures. The cache now holds only the
+per-figure averages, packed in two parts (history and current). Both are pickled the
+way RedisCache does before sizing, and each read is timed through to the JSON Dash
+sends to the browser.
+
+Run from the repo root:  python benchmarks/bench_graph_cache.py
+"""
+import json
+import os
+import pickle
+import sys
+import time
+
+import plotly
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregates import build_aggregates, history_summary, current_summary, merge_summaries, tables_from_summary
+from cache_utils import pack, unpack
+from graphs import (GRAPHS_SCHEMA_VERSION, generate_summary_statistics, generate_monthly_mood_plot,
+                    generate_weekly_mood_plot, generate_day_of_week_plot, generate_time_of_day_plot)
+from bench_aggregation import make_frame
+
+SIZES = [300, 3_000, 30_000]
+REPEAT = 20
+
+
+def build_graphs(tables):
+    """generate_all_graphs without the cache."""
+    return (generate_summary_statistics(tables['stats']),
+            generate_monthly_mood_plot(tables['monthly']),
+            generate_weekly_mood_plot(tables['weekly']),
+            generate_day_of_week_plot(tables['day_of_week']),
+            generate_time_of_day_plot(tables['time_of_day']))
+
+
+def render(graphs):
+    """Serialize the layout pieces the way Dash does for the response."""
+    return json.dumps([part.to_plotly_json() for part in graphs], cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def legacy_read(blob):
+    return render(pickle.loads(blob))
+
+
+def packed_read(history_blob, current_blob):
+    history = unpack(pickle.loads(history_blob), GRAPHS_SCHEMA_VERSION)
+    current = unpack(pickle.loads(current_blob), GRAPHS_SCHEMA_VERSION)
+    return render(build_graphs(tables_from_summary(merge_summaries(history, current))))
+
+
+def timed(func, *args):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    print(f"{'entries':>8} {'legacy bytes':>13} {'packed bytes':>13} {'legacy read (ms)':>17} {'packed read (ms)':>17}")
+    for n in SIZES:
+        df = make_frame(n)
+        df['date'] = df['date'].dt.tz_localize('UTC')  # fetch_rows hands build_aggregates UTC timestamps
+        aggregates = build_aggregates(df)
+        history = history_summary(aggregates)
+        current = current_summary(aggregates, history)
+
+        legacy_blob = pickle.dumps(build_graphs(tables_from_summary(merge_summaries(history, current))))
+        history_blob = pickle.dumps(pack(history, GRAPHS_SCHEMA_VERSION))
+        current_blob = pickle.dumps(pack(current, GRAPHS_SCHEMA_VERSION))
+        packed_bytes = len(history_blob) + len(current_blob)
+
+        # Both reads must hand Dash the same figures (unpickling reorders the layout keys)
+        assert json.loads(legacy_read(legacy_blob)) == json.loads(packed_read(history_blob, current_blob))
+
+        legacy = timed(legacy_read, legacy_blob) * 1000
+        packed = timed(packed_read, history_blob, current_blob) * 1000
+        print(f"{n:>8} {len(legacy_blob):>13,} {packed_bytes:>13,} {legacy:>17.1f} {packed:>17.1f}")
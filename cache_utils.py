@@ -0,0 +1,324 @@
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from flask import current_app
+from flask_caching.backends import RedisCache
+
+# How long a recompute may hold its lock before other workers give up waiting and compute it themselves
+LOCK_TIMEOUT = 60
+LOCK_POLL_INTERVAL = 0.1
+
+# In-process tier of TwoTierRedisCache: how many entries each worker keeps, and for how long at most
+# (the bound on staleness if an invalidation message is ever missed)
+LOCAL_MAX_ENTRIES = 256
+LOCAL_TTL = 60
+# Each worker logs its hit rates every STATS_LOG_EVERY lookups (0 turns the log off)
+STATS_LOG_EVERY = 1000
+
+
+def pack(obj, version):
+    """Serialize a JSON-friendly object for the cache: a 2-byte schema version, then zlib-compressed JSON."""
+    payload = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    return struct.pack('>H', version) + zlib.compress(payload, 6)
+
+
+def unpack(data, version):
+    """Read an entry written by pack. Missing entries and entries from another schema version read as None."""
+    if not data or struct.unpack('>H', data[:2])[0] != version:
+        return None
+    return json.loads(zlib.decompress(data[2:]))
+
+
+def single_flight(cache, key, compute, poll, lock_timeout=LOCK_TIMEOUT):
+    """Run compute() in at most one worker at a time for key.
+
+    The lock is an add() on the shared cache, which is atomic (SET NX) on Redis.
+    Workers that lose it call poll() until it returns the winner's result, or until
+    the lock times out, in which case they compute the value themselves.
+    """
+    lock_key = f'{key}_lock'
+    deadline = time.time() + lock_timeout
+    acquired = cache.add(lock_key, True, timeout=lock_timeout)
+    while not acquired and time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = poll()
+        if value is not None:
+            return value
+        acquired = cache.add(lock_key, True, timeout=lock_timeout)
+
+    try:
+        return compute()
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+def _entry(cache, key):
+    # Anything that isn't a stale_while_revalidate envelope (e.g. written by older code) reads as a miss
+    entry = cache.get(key)
+    return entry if isinstance(entry, dict) and 'stored_at' in entry else None
+
+
+def _store(cache, key, value, fresh_for, max_stale, stored_at=None, revision=0):
+    cache.set(key, {'value': value, 'stored_at': stored_at or time.time(), 'revision': revision},
+              timeout=int(fresh_for + max_stale))
+    return value
+
+
+def _stamp(entry):
+    # Identifies one write of an entry: update_cached keeps stored_at but bumps the revision
+    return (entry['stored_at'], entry.get('revision', 0)) if entry is not None else None
+
+
+def _refresh(app, cache, key, compute, fresh_for, max_stale, stamp):
+    with app.app_context():
+        try:
+            value = compute()
+            # Only replace the entry the refresh started from. If it was updated in place (update_cached),
+            # rewritten or deleted meanwhile, the refreshed value may predate that change, so it's dropped
+            if _stamp(_entry(cache, key)) == stamp:
+                _store(cache, key, value, fresh_for, max_stale)
+            else:
+                print(f"Discarded background refresh of {key}: the entry changed while it ran")
+        except Exception as e:
+            print(f"Background refresh of {key} failed: {e}")
+        finally:
+            cache.delete(f'{key}_lock')
+
+
+def stale_while_revalidate(cache, key, compute, fresh_for, max_stale):
+    """Read-through cache with stale-while-revalidate and single-flight recomputes.
+
+    An entry is fresh for fresh_for seconds. After that it is still served for up to
+    max_stale more seconds while the one worker that wins the lock refreshes it in a
+    background thread. Past that hard limit, or on a miss, the value is recomputed
+    synchronously by a single worker and the others wait for its result.
+
+    compute must not rely on the request context (g, session); pass what it needs in.
+    """
+    entry = _entry(cache, key)
+    if entry is not None:
+        age = time.time() - entry['stored_at']
+        if age < fresh_for:
+            return entry['value']
+        if age < fresh_for + max_stale:
+            if cache.add(f'{key}_lock', True, timeout=LOCK_TIMEOUT):
+                app = current_app._get_current_object()
+                threading.Thread(target=_refresh, args=(app, cache, key, compute, fresh_for, max_stale, _stamp(entry)),
+                                 daemon=True).start()
+            return entry['value']
+
+    def poll():
+        entry = _entry(cache, key)
+        return entry['value'] if entry is not None and time.time() - entry['stored_at'] < fresh_for else None
+
+    return single_flight(cache, key, lambda: _store(cache, key, compute(), fresh_for, max_stale), poll)
+
+
+def set_cached(cache, key, value, fresh_for, max_stale):
+    """Store a freshly computed value in the format stale_while_revalidate reads."""
+    return _store(cache, key, value, fresh_for, max_stale)
+
+
+def update_cached(cache, key, update, fresh_for, max_stale):
+    """Apply update() to a value cached by stale_while_revalidate, keeping its age. Does nothing on a miss.
+
+    The entry's revision is bumped, so a background refresh that started before the update discards its result.
+    """
+    entry = _entry(cache, key)
+    if entry is None:
+        return None
+    return _store(cache, key, update(entry['value']), fresh_for, max_stale, stored_at=entry['stored_at'],
+                  revision=entry.get('revision', 0) + 1)
+
+
+class TwoTierRedisCache(RedisCache):
+    """RedisCache with a size-bounded, in-process LRU tier in front of it.
+
+    Reads are served from the worker's own memory when it can, skipping the Redis round
+    trip and the unpickling. Every write or delete is published on a Redis channel, and
+    each worker runs a listener thread that evicts its local copy of the key, so an
+    invalidation on one worker (e.g. submit_entry) reaches them all. Local copies are
+    shared between threads: set a modified copy back rather than mutating one in place.
+
+    Select it with CACHE_TYPE = 'cache_utils.TwoTierRedisCache'; CACHE_LOCAL_MAX_ENTRIES
+    and CACHE_LOCAL_TTL size the local tier, and CACHE_STATS_LOG_EVERY sets how often
+    each worker logs its hit rates (see cache_stats).
+    """
+
+    def __init__(self, *args, local_max_entries=LOCAL_MAX_ENTRIES, local_ttl=LOCAL_TTL,
+                 stats_log_every=STATS_LOG_EVERY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = OrderedDict()  # key -> (expires_at, value)
+        self._local_lock = threading.Lock()
+        self._local_max_entries = local_max_entries
+        self._local_ttl = local_ttl
+        self._stats_log_every = stats_log_every
+        # Bumped on every eviction, so a Redis read that raced an invalidation isn't kept locally
+        self._generation = 0
+        self._channel = f'{self.key_prefix}cache_invalidations'
+        self._listener_pid = None
+        self._worker_id = None
+        self.stats = {'local_hits': 0, 'local_misses': 0, 'redis_hits': 0, 'redis_misses': 0}
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            local_max_entries=config.get('CACHE_LOCAL_MAX_ENTRIES', LOCAL_MAX_ENTRIES),
+            local_ttl=config.get('CACHE_LOCAL_TTL', LOCAL_TTL),
+            stats_log_every=config.get('CACHE_STATS_LOG_EVERY', STATS_LOG_EVERY)
+        )
+        return super().factory(app, config, args, kwargs)
+
+    def _count(self, stat):
+        with self._local_lock:
+            self.stats[stat] += 1
+
+    def cache_stats(self):
+        """This worker's lookup counts per tier, with the local and overall hit rates."""
+        with self._local_lock:
+            stats = dict(self.stats)
+        lookups = stats['local_hits'] + stats['local_misses']
+        stats['local_hit_rate'] = round(stats['local_hits'] / lookups, 3) if lookups else None
+        stats['hit_rate'] = round((stats['local_hits'] + stats['redis_hits']) / lookups, 3) if lookups else None
+        return stats
+
+    def _log_stats(self, lookups):
+        if self._stats_log_every and lookups % self._stats_log_every == 0:
+            stats = self.cache_stats()
+            print(f"Cache stats (pid {os.getpid()}): {lookups} lookups, local hit rate {stats['local_hit_rate']:.0%}, "
+                  f"overall hit rate {stats['hit_rate']:.0%}, {stats['redis_misses']} misses")
+
+    def get(self, key):
+        self._ensure_listener()
+        with self._local_lock:
+            item = self._local.get(key)
+            if item is not None and item[0] > time.time():
+                self._local.move_to_end(key)
+                self.stats['local_hits'] += 1
+                value = item[1]
+            else:
+                self._local.pop(key, None)
+                self.stats['local_misses'] += 1
+                value = None
+            generation = self._generation
+            lookups = self.stats['local_hits'] + self.stats['local_misses']
+        self._log_stats(lookups)
+        if value is not None:
+            return value
+
+        value = super().get(key)
+        if value is None:
+            self._count('redis_misses')
+            return None
+        self._count('redis_hits')
+        self._remember(key, value, generation=generation)
+        return value
+
+    def set(self, key, value, timeout=None):
+        self._ensure_listener()
+        result = super().set(key, value, timeout=timeout)
+        self._publish(key)
+        if result:
+            self._remember(key, value, timeout=timeout)
+        return result
+
+    def add(self, key, value, timeout=None):
+        self._ensure_listener()
+        created = super().add(key, value, timeout=timeout)
+        if created:
+            self._publish(key)
+        return created
+
+    # Like set, deletes are published only once Redis has them, so a worker that re-reads
+    # the key on the invalidation can't pick up the old value and keep it locally
+    def delete(self, key):
+        self._ensure_listener()
+        self._forget(key)
+        result = super().delete(key)
+        self._publish(key)
+        return result
+
+    def delete_many(self, *keys):
+        self._ensure_listener()
+        if not keys:
+            return []
+        for key in keys:
+            self._forget(key)
+        # One DEL for all of them (the base class deletes one by one, stopping at the first missing key)
+        self._write_client.delete(*[(self.key_prefix or '') + key for key in keys])
+        for key in keys:
+            self._publish(key)
+        return list(keys)
+
+    def clear(self):
+        self._ensure_listener()
+        self._forget_all()
+        result = super().clear()
+        self._publish('')
+        return result
+
+    def _remember(self, key, value, timeout=None, generation=None):
+        ttl = self._local_ttl if not timeout else min(timeout, self._local_ttl)
+        with self._local_lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._local[key] = (time.time() + ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _forget(self, key):
+        with self._local_lock:
+            self._generation += 1
+            self._local.pop(key, None)
+
+    def _forget_all(self):
+        with self._local_lock:
+            self._generation += 1
+            self._local.clear()
+
+    def _publish(self, key):
+        # An empty key means "everything"
+        try:
+            self._write_client.publish(self._channel, f'{self._worker_id} {key}')
+        except Exception as e:
+            print(f"Failed to publish cache invalidation for {key}: {e}")
+
+    def _ensure_listener(self):
+        # One listener per process; a forked worker starts its own under a new id
+        if self._listener_pid == os.getpid():
+            return
+        with self._local_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._worker_id = uuid.uuid4().hex
+            self._local.clear()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._read_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                # Anything published while we weren't subscribed was missed, so start from empty
+                self._forget_all()
+                for message in pubsub.listen():
+                    data = message['data']
+                    sender, key = (data.decode() if isinstance(data, bytes) else data).split(' ', 1)
+                    if sender == self._worker_id:
+                        continue
+                    if key:
+                        self._forget(key)
+                    else:
+                        self._forget_all()
+            except Exception as e:
+                print(f"Cache invalidation listener disconnected, resubscribing: {e}")
+                time.sleep(1)
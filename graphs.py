@@ -1,75 +1,261 @@
+import copy
+import hashlib
 import pandas as pd
-import pytz
-import plotly.express as px
-from datetime import datetime
+import pyarrow as pa
+import plotly.graph_objects as go
 from dash import html
-from flask import g, session
+from flask import g
 from flask_caching import Cache
 import os
 
+from utils.supabase_utils import load_frame
+from utils.time_utils import parse_utc_dates
+from aggregates import (AGGREGATES_VERSION, build_aggregates, update_aggregates, entry_periods, open_periods,
+                        history_summary, current_summary, merge_summaries, tables_from_summary, local_today,
+                        day_index, range_totals, range_series)
+from cache_utils import pack, unpack, single_flight, stale_while_revalidate, set_cached, update_cached
+
 # Initialize Cache with Redis directly in this file
 cache = Cache()
 
+# The aggregate store is kept up to date on every submit, so it can outlive the other caches
+AGGREGATES_TIMEOUT = 604800  # 7 days
+# After a day the store is still served, but rebuilt from the raw rows in the background
+AGGREGATES_FRESH_FOR = 86400
+
+# The graph cache holds only the per-figure averages; bump this when their layout changes
+GRAPHS_SCHEMA_VERSION = 1
+# Averages for past months and weeks only change on a backdated entry, so they outlive submits
+HISTORY_FRESH_FOR = 86400
+HISTORY_MAX_STALE = 86400
+# Quick stats and the open periods are dropped on every submit, and recomputed once the user's date rolls over
+CURRENT_FRESH_FOR = 900
+CURRENT_MAX_STALE = 300
+
 def init_cache(app):
-    """Initialize Redis cache for the given Flask app."""
-    app.config['CACHE_TYPE'] = 'RedisCache'
+    """Initialize the two-tier (in-process LRU in front of Redis) cache for the given Flask app."""
+    app.config['CACHE_TYPE'] = 'cache_utils.TwoTierRedisCache'
     app.config['CACHE_REDIS_URL'] = os.getenv('REDISCLOUD_URL')
     cache.init_app(app)
 
-# Load data from Supabase with cache
-@cache.cached(timeout=10800, key_prefix=lambda: f'supabase_data_cache_{g.user_uuid}')  # Cache for 24 hours per user
-def load_data(supabase, SUPABASE_DB):
-    """Function to load data from Supabase for a specific user."""
-    if not g.user_uuid:
-        raise ValueError("User not authenticated")
-        
-    response = supabase.table(f'{SUPABASE_DB}').select('id, date, mood, description','timezone').eq('user_uuid', g.user_uuid).execute()
-    data = response.data
-    df = pd.DataFrame(data)
-    df['date'] = pd.to_datetime(df['date'])
+# Columns pulled for the dashboard (it never reads descriptions). Bump LOAD_DATA_VERSION when these
+# or the cached format change, which forces every cached frame to be reloaded in full
+DATA_COLUMNS = ['id', 'date', 'mood', 'timezone']
+LOAD_DATA_VERSION = 3
+DATA_TIMEOUT = 604800  # 7 days, new rows are picked up by the delta sync
+
+def compact_frame(df):
+    """Shrink a frame of mood rows to compact dtypes: int32 ids, float32 moods and categorical timezones."""
+    return df.astype({'id': 'int32', 'mood': 'float32', 'timezone': 'category'})
+
+def frame_to_bytes(df):
+    """Serialize a frame as an Arrow IPC stream for the cache."""
+    sink = pa.BufferOutputStream()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def frame_from_bytes(data):
+    """Read a frame back from an Arrow IPC stream."""
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+def fetch_rows(supabase, SUPABASE_DB, user_uuid, after_id=None):
+    """Fetch the user's mood rows from Supabase, optionally only those with an id past after_id."""
+    df = load_frame(supabase, f'{SUPABASE_DB}', DATA_COLUMNS, [('eq', 'user_uuid', user_uuid)],
+                    dtypes={'id': 'int32', 'mood': 'float32'}, after_id=after_id)
+    df['date'] = parse_utc_dates(df['date'], df['timezone'])
+    return compact_frame(df)
+
+def _store_frame(key, df):
+    cache.set(key, {
+        'version': LOAD_DATA_VERSION,
+        'df': frame_to_bytes(df),
+        'max_id': int(df['id'].max()) if not df.empty else None,
+        'max_date': df['date'].max() if not df.empty else None
+    }, timeout=DATA_TIMEOUT)
     return df
 
-# Generate all graphs and stats with cache
-@cache.cached(timeout=10800, key_prefix=lambda: f'graphs_cache_{g.user_uuid}')  # Cache for 24 hours per user
-def generate_all_graphs(df):
-    """Generate all graphs and summary statistics."""
-    summary_stats = generate_summary_statistics(df)
-    fig_monthly_moods = generate_monthly_mood_plot(df)
-    fig_weekly_moods = generate_weekly_mood_plot(df)
-    fig_day_moods = generate_day_of_week_plot(df)
-    fig_time_moods = generate_time_of_day_plot(df)
-
-    return summary_stats, fig_monthly_moods, fig_weekly_moods, fig_day_moods, fig_time_moods
+def _cached_frame(key):
+    cached = cache.get(key)
+    return cached if cached is not None and cached.get('version') == LOAD_DATA_VERSION else None
 
+# Load data from Supabase with cache
+def load_data(supabase, SUPABASE_DB, user_uuid=None):
+    """Function to load data from Supabase for a specific user.
+
+    The cached frame remembers the highest id and date it has seen, so a refresh only
+    pulls the rows written since then and appends them. A full reload happens on a
+    cache miss or when the cached frame's version stamp is out of date, and only one
+    worker runs it at a time; the others wait for its frame. The frame is cached as an
+    Arrow IPC stream rather than a pickle.
+    """
+    user_uuid = user_uuid or g.user_uuid
+    if not user_uuid:
+        raise ValueError("User not authenticated")
 
-def generate_summary_statistics(df):
-    """Generate summary statistics for the mood data with timezone consideration."""
-    # Default to UTC if there are no entries
-    if df.empty:
-        user_timezone = pytz.timezone('UTC')
-    else:
-        # Pull the timezone from the latest entry
-        latest_entry_timezone = df.iloc[-1]['timezone']
-        user_timezone = pytz.timezone(latest_entry_timezone)
+    key = f'supabase_data_cache_{user_uuid}'
+    cached = _cached_frame(key)
+    if cached is None:
+        def poll():
+            cached = _cached_frame(key)
+            return frame_from_bytes(cached['df']) if cached is not None else None
+        return single_flight(cache, key, lambda: _store_frame(key, fetch_rows(supabase, SUPABASE_DB, user_uuid)), poll)
+
+    df = frame_from_bytes(cached['df'])
+    new_rows = fetch_rows(supabase, SUPABASE_DB, user_uuid, after_id=cached['max_id'])
+    if new_rows.empty:
+        return df
+    return _store_frame(key, compact_frame(pd.concat([df, new_rows], ignore_index=True)))
+
+def load_aggregates(supabase, SUPABASE_DB):
+    """Load the user's aggregate store.
+
+    The store is kept current by record_entry, so once it is a day old it is still
+    served while a background rebuild from the raw rows corrects any drift. It is
+    rebuilt synchronously only on a miss or once it is past AGGREGATES_TIMEOUT.
+    """
+    user_uuid = g.user_uuid
+    key = f'aggregates_cache_{user_uuid}'
+    def load():
+        return stale_while_revalidate(cache, key, lambda: build_aggregates(load_data(supabase, SUPABASE_DB, user_uuid)),
+                                      AGGREGATES_FRESH_FOR, AGGREGATES_TIMEOUT - AGGREGATES_FRESH_FOR)
+    aggregates = load()
+    if aggregates.get('version') != AGGREGATES_VERSION:
+        # Store written before a layout change; drop it and rebuild
+        cache.delete(key)
+        aggregates = load()
+    return aggregates
+
+def warm_dashboard_caches(supabase, SUPABASE_DB, user_uuid):
+    """Fill a user's dashboard caches ahead of their first visit, under the keys the web app reads.
+
+    Syncs the cached rows, rebuilds the aggregate store from them (fresh for another
+    day), and recomputes the graph summary and day index. Needs an app context.
+    """
+    g.user_uuid = user_uuid
+    aggregates = set_cached(cache, f'aggregates_cache_{user_uuid}', build_aggregates(load_data(supabase, SUPABASE_DB, user_uuid)),
+                            AGGREGATES_FRESH_FOR, AGGREGATES_TIMEOUT - AGGREGATES_FRESH_FOR)
+    cache.delete_many(f'graphs_history_cache_{user_uuid}', f'graphs_current_cache_{user_uuid}')
+    load_dashboard_summary(aggregates)
+    load_day_index(aggregates)
+    return aggregates
+
+def record_entry(user_uuid, entry):
+    """Fold a newly inserted entry into the user's cached aggregate store and drop the stale caches."""
+    backdated = True  # Without a cached store we can't tell, so assume the history is affected
+    def update(aggregates):
+        nonlocal backdated
+        if aggregates.get('version') == AGGREGATES_VERSION:
+            month, week = entry_periods(entry['date'], entry['timezone'])
+            open_month, open_week = open_periods(aggregates)
+            backdated = open_month is not None and (month < open_month or week < open_week)
+            # The cached store may be shared with other requests in this worker, so update a copy
+            aggregates = update_aggregates(copy.deepcopy(aggregates), entry['date'], entry['mood'], entry['timezone'])
+        return aggregates
+    update_cached(cache, f'aggregates_cache_{user_uuid}', update, AGGREGATES_FRESH_FOR, AGGREGATES_TIMEOUT - AGGREGATES_FRESH_FOR)
+
+    # Only the quick stats and open periods are recomputed; the cached rows pick the entry up on their next delta sync
+    cache.delete(f'graphs_current_cache_{user_uuid}')
+    if backdated:
+        cache.delete(f'graphs_history_cache_{user_uuid}')
+
+def _cached_summary(key, compute, fresh_for, max_stale):
+    """Read one packed part of the graph summary through the cache, recomputing it if it's missing or outdated."""
+    def load():
+        return unpack(stale_while_revalidate(cache, key, lambda: pack(compute(), GRAPHS_SCHEMA_VERSION),
+                                             fresh_for, max_stale), GRAPHS_SCHEMA_VERSION)
+    summary = load()
+    if summary is None:
+        # Written by another schema version; drop it and recompute
+        cache.delete(key)
+        summary = load()
+    return summary
+
+def dashboard_etag(aggregates):
+    """ETag for the user's dashboard data, cheap enough to check before building anything.
+
+    It changes with the user (so accounts sharing a browser never match each other's copy),
+    the store and summary schema versions, every new entry (the count and latest day), and
+    the user's local date, since the quick stats roll over at midnight.
+    """
+    stamp = (f"{g.user_uuid}:{AGGREGATES_VERSION}:{GRAPHS_SCHEMA_VERSION}:{aggregates['count']}:"
+             f"{aggregates['today'][0]}:{local_today(aggregates)}")
+    return hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:20]
+
+def load_dashboard_summary(aggregates):
+    """Load the per-figure averages and quick stats, as JSON-friendly lists, through the graph cache.
+
+    The cache keeps only the compressed, version-stamped per-figure averages, split by
+    volatility: the history (past months and weeks) survives new entries, while the
+    current part (quick stats, the open month and week, day-of-week and time-of-day
+    bars) is dropped on every submit and recomputed from a few buckets, and at the
+    user's midnight.
+    """
+    history_key = f'graphs_history_cache_{g.user_uuid}'
+    current_key = f'graphs_current_cache_{g.user_uuid}'
+    periods = list(open_periods(aggregates))
+
+    history = _cached_summary(history_key, lambda: history_summary(aggregates), HISTORY_FRESH_FOR, HISTORY_MAX_STALE)
+    if [history['current_month'], history['current_week']] != periods:
+        # The open month or week has moved on since the history was cached
+        cache.delete(history_key)
+        history = _cached_summary(history_key, lambda: history_summary(aggregates), HISTORY_FRESH_FOR, HISTORY_MAX_STALE)
+
+    current = _cached_summary(current_key, lambda: current_summary(aggregates, history), CURRENT_FRESH_FOR, CURRENT_MAX_STALE)
+    if [current['current_month'], current['current_week'], current.get('today')] != periods + [local_today(aggregates)]:
+        # Cached against other open periods, or before the user's midnight (the quick stats' "today" has moved on)
+        cache.delete(current_key)
+        current = _cached_summary(current_key, lambda: current_summary(aggregates, history), CURRENT_FRESH_FOR, CURRENT_MAX_STALE)
+
+    return merge_summaries(history, current)
+
+def load_dashboard_tables(aggregates):
+    """Load the small tables the dashboard figures are built from."""
+    return tables_from_summary(load_dashboard_summary(aggregates))
+
+def load_day_index(aggregates):
+    """Load the user's prefix-sum day index, rebuilding it only when the store has moved on."""
+    key = f'day_index_cache_{g.user_uuid}'
+    stamp = [aggregates['count'], aggregates['today'][0]]
+    cached = cache.get(key)
+    if cached is not None and cached['stamp'] == stamp:
+        return cached['index']
+    index = day_index(aggregates)
+    cache.set(key, {'stamp': stamp, 'index': index}, timeout=AGGREGATES_TIMEOUT)
+    return index
+
+def range_tables(aggregates, start_date, end_date):
+    """Average, entry count and monthly/weekly tables for a date range, answered from the day index."""
+    index = load_day_index(aggregates)
+    total, count = range_totals(index, start_date, end_date)
+    return {
+        'average': total / count if count else None,
+        'count': count,
+        'monthly': range_series(index, start_date, end_date, 'M'),
+        'weekly': range_series(index, start_date, end_date, 'W')
+    }
 
-    # Convert today's date to the user's timezone
-    today = pd.to_datetime(datetime.now(user_timezone).date())
+# Generate all graphs and stats with cache
+def generate_all_graphs(aggregates):
+    """Generate all graphs and summary statistics from the user's aggregate store.
+
+    The figures themselves are rebuilt from the cached averages on every read.
+    """
+    tables = load_dashboard_tables(aggregates)
+    summary_stats = generate_summary_statistics(tables['stats'])
+    fig_monthly_moods = generate_monthly_mood_plot(tables['monthly'])
+    fig_weekly_moods = generate_weekly_mood_plot(tables['weekly'])
+    fig_day_moods = generate_day_of_week_plot(tables['day_of_week'])
+    fig_time_moods = generate_time_of_day_plot(tables['time_of_day'])
 
-    # Filter for today's entries based on the user's timezone
-    today_entries = df[df['date'].dt.tz_localize('UTC').dt.tz_convert(user_timezone).dt.date == today.date()]
+    return summary_stats, fig_monthly_moods, fig_weekly_moods, fig_day_moods, fig_time_moods
 
-    # Calculate monthly baseline mood
-    if not df.empty:
-        df['Month Start'] = df['date'].dt.to_period('M').dt.to_timestamp()  # Add monthly grouping
-        monthly_mood_avg = df.groupby('Month Start')['mood'].mean().reset_index()
-        baseline_mood = monthly_mood_avg['mood'].ewm(alpha=0.3).mean().iloc[-1]  # EMA of monthly averages
-    else:
-        baseline_mood = "No data"
 
-    #calculate the other stats
-    today_mood = today_entries['mood'].mean() if not today_entries.empty else "No entries today"
-    mood_entries_today = len(today_entries)
-    mood_entries_all_time = len(df)
+def generate_summary_statistics(stats):
+    """Generate the summary statistics layout for the mood data."""
+    today_mood = stats['today_mood']
+    baseline_mood = stats['baseline_mood']
 
     # Create the summary stats layout
     summary_stats = html.Div([
@@ -78,210 +264,147 @@ def generate_summary_statistics(df):
                 f"{today_mood if isinstance(today_mood, str) else f'{today_mood:.2f}'}"]),
         html.P([html.B("Baseline Mood: "),  # Use html.B for bold text
                 f"{baseline_mood if isinstance(baseline_mood, str) else f'{baseline_mood:.2f}'}"]),        
-        html.P(f"Mood Entries Today: {mood_entries_today}"),
-        html.P(f"Mood Entries (all time): {mood_entries_all_time}")
+        html.P(f"Mood Entries Today: {stats['mood_entries_today']}"),
+        html.P(f"Mood Entries (all time): {stats['mood_entries_all_time']}")
     ])
     
     return summary_stats
 
-def generate_monthly_mood_plot(df, alpha=0.3):
+def generate_monthly_mood_plot(monthly_mood_avg, alpha=0.3):
     """Generate the monthly mood plot with EMA line."""
-    df['Month Start'] = df['date'].dt.to_period('M').dt.to_timestamp()
-    monthly_mood_avg = df.groupby('Month Start')['mood'].mean().reset_index()
-    
     # Calculate the EMA
-    monthly_mood_avg['EMA'] = monthly_mood_avg['mood'].ewm(alpha=alpha).mean()
-    
-    # Create the bar plot for monthly average mood
-    fig_monthly_moods = px.bar(monthly_mood_avg, x='Month Start', y='mood', title='Average Mood by Month Start Date')
-
-    # Add the EMA line with formatted label
-    fig_monthly_moods.add_scatter(x=monthly_mood_avg['Month Start'], y=monthly_mood_avg['EMA'],
-                                  mode='lines', name=f'Baseline Mood<br>(ema α={alpha})', line=dict(color='orange')
-    )
-
-    # Prepare tick values and labels for months
-    tick_vals = monthly_mood_avg['Month Start']
-    tick_text = monthly_mood_avg['Month Start'].dt.strftime('%Y-%m')
-
-    fig_monthly_moods.update_xaxes(
-        tickmode='array',
-        tickvals=tick_vals,
-        ticktext=tick_text
+    ema = monthly_mood_avg['mood'].ewm(alpha=alpha).mean()
+
+    # Build the figure in one go; chained update_* calls cost more than the figure itself
+    fig_monthly_moods = go.Figure(
+        data=[
+            # Bar plot for monthly average mood
+            go.Bar(x=monthly_mood_avg['Month Start'], y=monthly_mood_avg['mood'], marker_color='#636efa', showlegend=False,
+                   hovertemplate='Month Start=%{x}<br>mood=%{y}<extra></extra>'),
+            # EMA line with formatted label
+            go.Scatter(x=monthly_mood_avg['Month Start'], y=ema, mode='lines',
+                       name=f'Baseline Mood<br>(ema α={alpha})', line=dict(color='orange'))
+        ],
+        layout=dict(
+            title=dict(text='Average Mood by Month Start Date'),
+            xaxis=dict(
+                title=dict(text='Month Start'),
+                # Tick values and labels for months
+                tickmode='array',
+                tickvals=monthly_mood_avg['Month Start'],
+                ticktext=monthly_mood_avg['Month Start'].dt.strftime('%Y-%m')
+            ),
+            yaxis=dict(title=dict(text='mood'))
+        )
     )
     
     return fig_monthly_moods
 
 
-import pandas as pd
-import plotly.express as px
-
-def generate_weekly_mood_plot(df):
+def generate_weekly_mood_plot(weekly_mood_avg):
     """Generate the weekly mood plot with EMA overlay."""
-    # Define the start of each week
-    df['Week Start'] = (df['date'] - pd.to_timedelta(df['date'].dt.weekday, unit='d')).dt.date
-    weekly_mood_avg = df.groupby('Week Start')['mood'].mean().reset_index()
-    
     # Calculate EMA on the weekly mood average
     alpha = 0.3  # Controls the decay rate; adjust as needed
-    weekly_mood_avg['EMA'] = weekly_mood_avg['mood'].ewm(alpha=alpha).mean()
-    
-    # Create the bar chart for weekly mood averages
-    fig_weekly_moods = px.bar(weekly_mood_avg, x='Week Start', y='mood', title='Average Mood by Week')
-    
-    # Add the EMA line
-    fig_weekly_moods.add_scatter(x=weekly_mood_avg['Week Start'], y=weekly_mood_avg['EMA'],
-                                 mode='lines', name=f'Baseline Mood<br> (ema α={alpha})', line=dict(color='orange'))
-    
-    # Customize tick values and labels
-    tick_vals = weekly_mood_avg['Week Start']
-    tick_text = weekly_mood_avg['Week Start']
-    
-    fig_weekly_moods.update_xaxes(
-        tickmode='array',
-        tickvals=tick_vals,
-        ticktext=tick_text,
-        rangeslider=dict(
-            visible=True,  # Enable the rangeslider
-            thickness=0.05,  # Make the slider minimal in thickness
-            bgcolor="white",  # Set the background color to blend with the graph
-            bordercolor="gray",  # Add a border for better visibility
-            borderwidth=1  # Keep the border thin for subtle design
-        ),
-        range=[
-            weekly_mood_avg['Week Start'].iloc[-8] - pd.Timedelta(days=3),  # Add padding to the start
-            weekly_mood_avg['Week Start'].iloc[-1] + pd.Timedelta(days=3)   # Add padding to the end
-        ]
-    )
-    
-    # Update layout for better visualization
-    fig_weekly_moods.update_layout(
-        xaxis=dict(
-            title='Week Start',
-            rangeselector=dict(visible=False),  # Remove the range selector
-            showgrid=False  # Keep gridlines off for cleaner visuals
-        ),
-        yaxis=dict(title='Mood'),
-        margin=dict(l=50, r=50, t=50, b=50),
-        dragmode=False,  # Disable dragging to simplify interaction
-        height=500  # Set height to keep it proportional
+    ema = weekly_mood_avg['mood'].ewm(alpha=alpha).mean()
+
+    # Open on the last 8 weeks (or all of them, if there are fewer)
+    shown = weekly_mood_avg['Week Start'].iloc[-8:]
+
+    fig_weekly_moods = go.Figure(
+        data=[
+            # Bar chart for weekly mood averages
+            go.Bar(x=weekly_mood_avg['Week Start'], y=weekly_mood_avg['mood'], marker_color='#636efa', showlegend=False,
+                   hovertemplate='Week Start=%{x}<br>mood=%{y}<extra></extra>'),
+            # EMA line
+            go.Scatter(x=weekly_mood_avg['Week Start'], y=ema, mode='lines',
+                       name=f'Baseline Mood<br> (ema α={alpha})', line=dict(color='orange'))
+        ],
+        layout=dict(
+            title=dict(text='Average Mood by Week'),
+            xaxis=dict(
+                title=dict(text='Week Start'),
+                # Customize tick values and labels
+                tickmode='array',
+                tickvals=weekly_mood_avg['Week Start'],
+                ticktext=weekly_mood_avg['Week Start'],
+                rangeslider=dict(
+                    visible=True,  # Enable the rangeslider
+                    thickness=0.05,  # Make the slider minimal in thickness
+                    bgcolor="white",  # Set the background color to blend with the graph
+                    bordercolor="gray",  # Add a border for better visibility
+                    borderwidth=1  # Keep the border thin for subtle design
+                ),
+                range=[
+                    shown.iloc[0] - pd.Timedelta(days=3),  # Add padding to the start
+                    shown.iloc[-1] + pd.Timedelta(days=3)   # Add padding to the end
+                ] if not shown.empty else None,
+                rangeselector=dict(visible=False),  # Remove the range selector
+                showgrid=False  # Keep gridlines off for cleaner visuals
+            ),
+            yaxis=dict(title=dict(text='Mood')),
+            margin=dict(l=50, r=50, t=50, b=50),
+            dragmode=False,  # Disable dragging to simplify interaction
+            height=500  # Set height to keep it proportional
+        )
     )
 
-
     return fig_weekly_moods
 
 
-def generate_day_of_week_plot(df):
+def generate_day_of_week_plot(merged_data):
     """Generate the day of the week mood plot with conditional color-coding."""
-    df['day_only'] = df['date'].dt.date
-    df['Day'] = df['day_only'].apply(lambda x: x.strftime('%A'))
-
-    # Calculate long-run average mood by day
-    day_mood_avg = df.groupby('Day')['mood'].mean().reset_index()
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    day_mood_avg['Day'] = pd.Categorical(day_mood_avg['Day'], categories=day_order, ordered=True)
-
-    # Calculate the most recent mood average by day
-    df_sorted = df.sort_values('date', ascending=False)
-    latest_mood_per_day = df_sorted.groupby('Day').head(1)
-    daily_mood_avg_recent = df[df['day_only'].isin(latest_mood_per_day['day_only'])].groupby(['Day'])['mood'].mean().reset_index()
-
-    # Merge the long-run and recent averages
-    merged_data = pd.merge(day_mood_avg, daily_mood_avg_recent, on='Day', how='left', suffixes=('_weekly_avg', '_latest_avg'))
-    merged_data['Day'] = pd.Categorical(merged_data['Day'], categories=day_order, ordered=True)
-    merged_data = merged_data.sort_values('Day')
-    merged_data = pd.merge(merged_data, latest_mood_per_day[['Day', 'day_only']], on='Day', how='left')
-
     # Define colors based on mood comparison
     colors = ['#40cf8b' if latest >= weekly else '#ef553b' for weekly, latest in zip(merged_data['mood_weekly_avg'], merged_data['mood_latest_avg'])]
 
-    # Plot the bars
-    fig_day_moods = px.bar(
-        merged_data, 
-        x='Day', 
-        y=['mood_weekly_avg', 'mood_latest_avg'], 
-        barmode='group',
-        title='All-Time Daily Mood Average vs Most Recent Daily Mood by Day of Week',
-        color_discrete_sequence=['#636efa', colors]  # Purple tone for long-run, green/red for recent
-    )
-
-    # Rename the legend items for clarity
-    fig_day_moods.update_traces(
-        name="All-Time Average", 
-        selector=dict(name="mood_weekly_avg")
-    )
-    fig_day_moods.update_traces(
-        name="Recent Average", 
-        selector=dict(name="mood_latest_avg")
-    )
-
-    # Update the hover data and layout
-    fig_day_moods.update_traces(
-        hovertemplate='<b>%{x}</b><br>All-Time Avg: %{customdata[0]:.2f}<br>Recent Avg: %{customdata[1]:.2f} (on %{customdata[2]})',
-        customdata=merged_data[['mood_weekly_avg', 'mood_latest_avg', 'day_only']],
+    # Hover shows both averages and the date of the recent one
+    hovertemplate = '<b>%{x}</b><br>All-Time Avg: %{customdata[0]:.2f}<br>Recent Avg: %{customdata[1]:.2f} (on %{customdata[2]})'
+    customdata = merged_data[['mood_weekly_avg', 'mood_latest_avg', 'day_only']]
+    days = merged_data['Day'].astype(str)
+
+    # Plot the bars, purple tone for long-run, green/red for recent
+    fig_day_moods = go.Figure(
+        data=[
+            go.Bar(x=days, y=merged_data['mood_weekly_avg'], name="All-Time Average", marker_color='#636efa',
+                   hovertemplate=hovertemplate, customdata=customdata),
+            go.Bar(x=days, y=merged_data['mood_latest_avg'], name="Recent Average", marker_color=colors,
+                   hovertemplate=hovertemplate, customdata=customdata)
+        ],
+        layout=dict(
+            barmode='group',
+            title=dict(text='All-Time Daily Mood Average vs Most Recent Daily Mood by Day of Week'),
+            xaxis=dict(title=dict(text='Day')),
+            yaxis=dict(title=dict(text='value')),
+            legend=dict(title=dict(text='variable'))
+        )
     )
     
     return fig_day_moods
 
-def generate_time_of_day_plot(df):
+def generate_time_of_day_plot(merged_data):
     """Generate the time of day mood plot with conditional color-coding."""
-    df['date_only'] = df['date'].dt.date
-    
-    # Define time-of-day bins with labels showing times
-    bins = [0, 9, 12, 16, 20, 24]
-    labels = [
-        'Early Morning (4 AM - 9 AM)', 
-        'Late Morning (9 AM - 12 PM)', 
-        'Afternoon (12 PM - 4 PM)', 
-        'Evening (4 PM - 8 PM)', 
-        'Night (8 PM - 4 AM)'
-    ]
-    
-    # Categorize 'Time of Day' based on bins
-    df['Time of Day'] = pd.cut(df['date'].dt.hour, bins=bins, labels=labels, right=False)
-    
-    # Calculate all-time average mood per time of day
-    time_mood_avg = df.groupby('Time of Day', observed=True)['mood'].mean().reset_index()
-    
-    # Get the latest dates for each 'Time of Day'
-    latest_dates = df.groupby('Time of Day', observed=True)['date_only'].max().reset_index()
-    
-    # Filter to get the most recent mood entries for each time of day
-    latest_mood_per_time = pd.merge(df, latest_dates, left_on=['Time of Day', 'date_only'], right_on=['Time of Day', 'date_only'], how='inner')
-    latest_mood_avg_per_time = latest_mood_per_time.groupby('Time of Day', observed=True).agg({'mood': 'mean', 'date_only': 'max'}).reset_index()
-
-    # Merge all-time averages with the latest averages
-    merged_data = pd.merge(time_mood_avg, latest_mood_avg_per_time, on='Time of Day', how='left', suffixes=('_all_time_avg', '_latest_avg'))
-    merged_data['Time of Day'] = pd.Categorical(merged_data['Time of Day'], categories=labels, ordered=True)
-    merged_data = merged_data.sort_values('Time of Day')
-    
     # Define colors based on mood comparison
     colors = ['#40cf8b' if latest >= all_time else '#ef553b' for all_time, latest in zip(merged_data['mood_all_time_avg'], merged_data['mood_latest_avg'])]
 
-    # Create the bar plot with conditional coloring
-    fig_time_moods = px.bar(
-        merged_data, 
-        x='Time of Day', 
-        y=['mood_all_time_avg', 'mood_latest_avg'], 
-        barmode='group',
-        title='All-Time vs Latest Mood by Time of Day',
-        color_discrete_sequence=['#636efa', colors]  # Purple for long-run, green/red for recent
-    )
-
-    # Rename the legend items for clarity
-    fig_time_moods.update_traces(
-        name="All-Time Average", 
-        selector=dict(name="mood_all_time_avg")
-    )
-    fig_time_moods.update_traces(
-        name="Recent Average", 
-        selector=dict(name="mood_latest_avg")
-    )
-
-    # Update hover info to show detailed data including entry date
-    fig_time_moods.update_traces(
-        hovertemplate='<b>%{x}</b><br>All-Time Avg: %{customdata[0]:.2f}<br>Recent Avg: %{customdata[1]:.2f} (on %{customdata[2]})',
-        customdata=merged_data[['mood_all_time_avg', 'mood_latest_avg', 'date_only']]
+    # Hover shows detailed data including entry date
+    hovertemplate = '<b>%{x}</b><br>All-Time Avg: %{customdata[0]:.2f}<br>Recent Avg: %{customdata[1]:.2f} (on %{customdata[2]})'
+    customdata = merged_data[['mood_all_time_avg', 'mood_latest_avg', 'date_only']]
+    times = merged_data['Time of Day'].astype(str)
+
+    # Create the bar plot with conditional coloring, purple for long-run, green/red for recent
+    fig_time_moods = go.Figure(
+        data=[
+            go.Bar(x=times, y=merged_data['mood_all_time_avg'], name="All-Time Average", marker_color='#636efa',
+                   hovertemplate=hovertemplate, customdata=customdata),
+            go.Bar(x=times, y=merged_data['mood_latest_avg'], name="Recent Average", marker_color=colors,
+                   hovertemplate=hovertemplate, customdata=customdata)
+        ],
+        layout=dict(
+            barmode='group',
+            title=dict(text='All-Time vs Latest Mood by Time of Day'),
+            xaxis=dict(title=dict(text='Time of Day')),
+            yaxis=dict(title=dict(text='value')),
+            legend=dict(title=dict(text='variable'))
+        )
     )
     
-    return fig_time_moods
\ No newline at end of file
+    return fig_time_moods
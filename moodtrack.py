@@ -14,13 +14,18 @@ from flask import (
     send_from_directory, g, session, redirect, url_for, flash
 )
 from flask_caching import Cache
-from dash import Dash, dcc, html
+from dash import Dash, dcc, html, Input, Output
+from dash.exceptions import PreventUpdate
 from supabase import create_client, Client
 
 # Local imports
 from utils.supabase_utils import insert_data_to_supabase
 from utils.supabase_storage_utils import download_summary_from_supabase
-from graphs import load_data, generate_all_graphs, init_cache
+from graphs import (
+    load_aggregates, record_entry, load_dashboard_summary, load_dashboard_tables, range_tables, dashboard_etag, init_cache,
+    generate_summary_statistics, generate_monthly_mood_plot, generate_weekly_mood_plot,
+    generate_day_of_week_plot, generate_time_of_day_plot
+)
 
 
 # Initialize Flask app
@@ -206,14 +211,12 @@ def submit_entry():
             'user_uuid': user_uuid
         }
 
-        success = insert_data_to_supabase(formatted_data)
-        if not success:
+        inserted = insert_data_to_supabase(formatted_data)
+        if not inserted:
             return jsonify({'message': 'Failed to insert data into Supabase.'}), 500
 
-         # Clear cache specifically for this user's data
-        from graphs import cache  # Import cache
-        cache.delete(f'supabase_data_cache_{user_uuid}')
-        cache.delete(f'graphs_cache_{user_uuid}')
+        # Fold the new entry into this user's cached aggregates instead of recomputing them
+        record_entry(user_uuid, inserted)
         
         return jsonify({'message': 'Data inserted successfully!'})
     
@@ -222,6 +225,34 @@ def submit_entry():
         return jsonify({'message': 'An error occurred'}), 500
 
 
+
+# Aggregated dashboard data for client-side rendering (MoodHQ page)
+@app.route('/api/dashboard_data')
+def dashboard_data():
+    if not g.user_uuid:
+        return jsonify({'message': 'User not authenticated'}), 403
+
+    sb: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY) #i have to recreate the client here for RLS. I'm not sure why. 
+    aggregates = load_aggregates(sb, SUPABASE_DB)
+
+    # The browser revalidates with If-None-Match; unchanged data costs a 304 and no summary work
+    etag = dashboard_etag(aggregates)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(load_dashboard_summary(aggregates))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    # The body depends on who's logged in, i.e. on the session cookie
+    response.headers['Vary'] = 'Cookie'
+    return response
+
+
+@app.route('/moodhq')
+@login_required
+def moodhq():
+    return render_template('dashboard.html')
+
     
 # Route for getting weekly summaries
 @app.route('/weekly-summary')
@@ -262,34 +293,79 @@ def render_dashboard():
     if not g.user_uuid:
         return redirect(url_for('login_page'))  # Redirect to login if UUID is missing
 
-     # Call generate_dashboard_layout to get the actual layout and assign it to dash_app.layout
-    dash_app.layout = generate_dashboard_layout()
-    
-    # Directly return the layout rendered by Dash, without a redirect
+    # The layout is a per-request function on dash_app; the figures fill in through their own callbacks
     return dash_app.index()  # Render the Dash app's layout directly
 
 
 # Initialize Dash app within Flask
 dash_app = Dash(__name__, server=app, url_base_pathname='/dashboard/')
 
-def generate_dashboard_layout():
-    print(f"Generating dashboard for user UUID: {g.user_uuid}")
-    # Load the data for graph generation and generate cached graphs
-    sb: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY) #i have to recreate the client here for RLS. I'm not sure why. 
-    df = load_data(sb, SUPABASE_DB)
-    summary_stats, fig_monthly_moods, fig_weekly_moods, fig_day_moods, fig_time_moods = generate_all_graphs(df)
-    
-    # Return the updated layout with the latest figures
+def serve_dashboard_layout():
+    """Dashboard skeleton, served on every page load.
+
+    It holds no user data, so it returns immediately; each figure is filled in by its
+    own callback below, which the browser fires concurrently.
+    """
     return html.Div(children=[
+        dcc.Location(id='dashboard-url'),
         html.H1(children='Mood Tracking Dashboard'),
-        summary_stats,
-        dcc.Graph(id='monthly-moods', figure=fig_monthly_moods),
-        dcc.Graph(id='weekly-moods', figure=fig_weekly_moods),
-        dcc.Graph(id='day-of-week-moods', figure=fig_day_moods),
-        dcc.Graph(id='time-of-day-moods', figure=fig_time_moods),
+        dcc.Loading(html.Div(id='summary-stats')),
+        # Pick a date range to recompute the monthly and weekly figures over it
+        dcc.DatePickerRange(id='dashboard-range', clearable=True),
+        html.Div(id='range-stats'),
+        dcc.Loading(dcc.Graph(id='monthly-moods')),
+        dcc.Loading(dcc.Graph(id='weekly-moods')),
+        dcc.Loading(dcc.Graph(id='day-of-week-moods')),
+        dcc.Loading(dcc.Graph(id='time-of-day-moods')),
     ])
 
-dash_app.layout =  html.Div("Loading...") 
+dash_app.layout = serve_dashboard_layout
+
+def dashboard_aggregates():
+    """Load the current user's aggregate store for a figure callback."""
+    if not g.user_uuid:
+        raise PreventUpdate
+    sb: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY) #i have to recreate the client here for RLS. I'm not sure why. 
+    return load_aggregates(sb, SUPABASE_DB)
+
+def dashboard_tables():
+    """Load the current user's dashboard tables (cached averages) for a figure callback."""
+    return load_dashboard_tables(dashboard_aggregates())
+
+@dash_app.callback(Output('summary-stats', 'children'), Input('dashboard-url', 'pathname'))
+def render_summary_stats(_):
+    return generate_summary_statistics(dashboard_tables()['stats'])
+
+@dash_app.callback(Output('range-stats', 'children'),
+                   Input('dashboard-range', 'start_date'), Input('dashboard-range', 'end_date'))
+def render_range_stats(start_date, end_date):
+    if not start_date or not end_date:
+        return None
+    tables = range_tables(dashboard_aggregates(), start_date, end_date)
+    average = f"{tables['average']:.2f}" if tables['count'] else "No entries"
+    return html.P([html.B(f"Average Mood ({start_date} to {end_date}): "), f"{average} over {tables['count']} entries"])
+
+@dash_app.callback(Output('monthly-moods', 'figure'), Input('dashboard-url', 'pathname'),
+                   Input('dashboard-range', 'start_date'), Input('dashboard-range', 'end_date'))
+def render_monthly_moods(_, start_date, end_date):
+    if start_date and end_date:
+        return generate_monthly_mood_plot(range_tables(dashboard_aggregates(), start_date, end_date)['monthly'])
+    return generate_monthly_mood_plot(dashboard_tables()['monthly'])
+
+@dash_app.callback(Output('weekly-moods', 'figure'), Input('dashboard-url', 'pathname'),
+                   Input('dashboard-range', 'start_date'), Input('dashboard-range', 'end_date'))
+def render_weekly_moods(_, start_date, end_date):
+    if start_date and end_date:
+        return generate_weekly_mood_plot(range_tables(dashboard_aggregates(), start_date, end_date)['weekly'])
+    return generate_weekly_mood_plot(dashboard_tables()['weekly'])
+
+@dash_app.callback(Output('day-of-week-moods', 'figure'), Input('dashboard-url', 'pathname'))
+def render_day_of_week_moods(_):
+    return generate_day_of_week_plot(dashboard_tables()['day_of_week'])
+
+@dash_app.callback(Output('time-of-day-moods', 'figure'), Input('dashboard-url', 'pathname'))
+def render_time_of_day_moods(_):
+    return generate_time_of_day_plot(dashboard_tables()['time_of_day'])
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5009))
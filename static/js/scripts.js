@@ -125,6 +125,12 @@ document.addEventListener('DOMContentLoaded', () => {
       });
     }
 
+    // Render the dashboard from aggregated data (only if #dashboardData is on this page)
+    const dashboardData = document.getElementById('dashboardData');
+    if (dashboardData) {
+        renderDashboard();
+    }
+
     // Handle logout (only if #logoutButton is on this page — some pages may have it, some may not)
     const logoutButtonGlobal = document.getElementById('logoutButton');
     if (logoutButtonGlobal) {
@@ -138,3 +144,106 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 });
+
+// Dashboard rendering from /api/dashboard_data. The response carries an ETag, so the browser
+// revalidates with If-None-Match and a repeat visit with no new entries costs a bodiless 304.
+const MOOD_BLUE = '#636efa';
+const MOOD_UP = '#40cf8b';
+const MOOD_DOWN = '#ef553b';
+const EMA_ALPHA = 0.3;
+
+// Exponential moving average with the same weighting as pandas' ewm(alpha).mean() (adjust=True)
+function ema(values, alpha) {
+    let weighted = 0;
+    let weights = 0;
+    return values.map(value => {
+        weighted = value + (1 - alpha) * weighted;
+        weights = 1 + (1 - alpha) * weights;
+        return weighted / weights;
+    });
+}
+
+function formatMood(value) {
+    return typeof value === 'string' ? value : value.toFixed(2);
+}
+
+function renderSummaryStats(stats) {
+    document.getElementById('summaryStats').innerHTML = `
+        <h2>Quick Stats</h2>
+        <p><b>Today's Mood: </b>${formatMood(stats.today_mood)}</p>
+        <p><b>Baseline Mood: </b>${formatMood(stats.baseline_mood)}</p>
+        <p>Mood Entries Today: ${stats.mood_entries_today}</p>
+        <p>Mood Entries (all time): ${stats.mood_entries_all_time}</p>`;
+}
+
+function renderTrend(elementId, x, moods, title, xTitle, extraLayout) {
+    Plotly.newPlot(elementId, [
+        { type: 'bar', x, y: moods, marker: { color: MOOD_BLUE }, showlegend: false,
+          hovertemplate: `${xTitle}=%{x}<br>mood=%{y}<extra></extra>` },
+        { type: 'scatter', mode: 'lines', x, y: ema(moods, EMA_ALPHA),
+          name: `Baseline Mood<br>(ema α=${EMA_ALPHA})`, line: { color: 'orange' } }
+    ], Object.assign({ title: { text: title }, xaxis: { title: { text: xTitle } }, yaxis: { title: { text: 'mood' } } }, extraLayout));
+}
+
+function renderLatestVsAllTime(elementId, labels, allTime, latest, latestDates, title, xTitle) {
+    // Recent bars are green when at or above the long-run average, red when below
+    const colors = allTime.map((avg, i) => latest[i] >= avg ? MOOD_UP : MOOD_DOWN);
+    const customdata = labels.map((_, i) => [allTime[i], latest[i], latestDates[i]]);
+    const hovertemplate = '<b>%{x}</b><br>All-Time Avg: %{customdata[0]:.2f}<br>Recent Avg: %{customdata[1]:.2f} (on %{customdata[2]})';
+    Plotly.newPlot(elementId, [
+        { type: 'bar', x: labels, y: allTime, name: 'All-Time Average', marker: { color: MOOD_BLUE }, customdata, hovertemplate },
+        { type: 'bar', x: labels, y: latest, name: 'Recent Average', marker: { color: colors }, customdata, hovertemplate }
+    ], {
+        barmode: 'group',
+        title: { text: title },
+        xaxis: { title: { text: xTitle } },
+        yaxis: { title: { text: 'value' } },
+        legend: { title: { text: 'variable' } }
+    });
+}
+
+async function renderDashboard() {
+    try {
+        const response = await fetch('/api/dashboard_data', { cache: 'no-cache' });
+        if (!response.ok) {
+            document.getElementById('summaryStats').textContent = 'Could not load your dashboard.';
+            return;
+        }
+        const data = await response.json();
+
+        renderSummaryStats(data.stats);
+
+        const months = data.monthly['Month Start'];
+        renderTrend('monthlyMoods', months, data.monthly.mood, 'Average Mood by Month Start Date', 'Month Start', {
+            xaxis: { title: { text: 'Month Start' }, tickmode: 'array', tickvals: months, ticktext: months.map(month => month.slice(0, 7)) }
+        });
+
+        // Open on the last 8 weeks, with a slider for the rest
+        const weeks = data.weekly['Week Start'];
+        const shown = weeks.slice(-8);
+        const padDays = (day, days) => new Date(Date.parse(day) + days * 86400000).toISOString().slice(0, 10);
+        renderTrend('weeklyMoods', weeks, data.weekly.mood, 'Average Mood by Week', 'Week Start', {
+            xaxis: {
+                title: { text: 'Week Start' }, tickmode: 'array', tickvals: weeks, ticktext: weeks,
+                rangeslider: { visible: true, thickness: 0.05, bgcolor: 'white', bordercolor: 'gray', borderwidth: 1 },
+                range: shown.length ? [padDays(shown[0], -3), padDays(shown[shown.length - 1], 3)] : undefined,
+                showgrid: false
+            },
+            yaxis: { title: { text: 'Mood' } },
+            margin: { l: 50, r: 50, t: 50, b: 50 },
+            dragmode: false,
+            height: 500
+        });
+
+        const days = data.day_of_week;
+        renderLatestVsAllTime('dayOfWeekMoods', days.Day, days.mood_weekly_avg, days.mood_latest_avg, days.day_only,
+            'All-Time Daily Mood Average vs Most Recent Daily Mood by Day of Week', 'Day');
+
+        const times = data.time_of_day;
+        renderLatestVsAllTime('timeOfDayMoods', times['Time of Day'], times.mood_all_time_avg, times.mood_latest_avg, times.date_only,
+            'All-Time vs Latest Mood by Time of Day', 'Time of Day');
+    } catch (error) {
+        console.error('Error:', error);
+        document.getElementById('summaryStats').textContent = 'An error occurred';
+    }
+}
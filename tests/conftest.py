@@ -0,0 +1,77 @@
+import sqlite3
+import types
+
+import pytest
+
+
+class PostgRESTQuery:
+    """The slice of the supabase-py query builder the loaders use, run as SQL on SQLite."""
+
+    OPERATORS = {'eq': '=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+    def __init__(self, server, table):
+        self.server = server
+        self.table = table
+        self.columns = '*'
+        self.count = None
+        self.conditions = []
+        self.params = []
+        self.ordering = ''
+        self.row_limit = None
+
+    def select(self, columns, count=None):
+        self.columns, self.count = columns, count
+        return self
+
+    def __getattr__(self, operator):
+        if operator not in self.OPERATORS:
+            raise AttributeError(operator)
+        def apply(column, value):
+            self.conditions.append(f'"{column}" {self.OPERATORS[operator]} ?')
+            self.params.append(value)
+            return self
+        return apply
+
+    def order(self, column, desc=False):
+        self.ordering = f' ORDER BY "{column}"' + (' DESC' if desc else '')
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def execute(self):
+        where = ' WHERE ' + ' AND '.join(self.conditions) if self.conditions else ''
+        total = None
+        if self.count == 'exact':
+            total = self.server.db.execute(f'SELECT COUNT(*) FROM {self.table}{where}', self.params).fetchone()[0]
+        # Like PostgREST's max-rows setting, the server caps every page whatever limit is asked for
+        limit = min(self.row_limit or self.server.max_rows, self.server.max_rows)
+        rows = self.server.db.execute(f'SELECT {self.columns} FROM {self.table}{where}{self.ordering} LIMIT ?',
+                                      self.params + [limit]).fetchall()
+        self.server.pages.append(len(rows))
+        return types.SimpleNamespace(data=[dict(row) for row in rows], count=total)
+
+
+class PostgRESTServer:
+    """A SQLite-backed stand-in for a Supabase client, with a server-side page cap."""
+
+    def __init__(self, tables, max_rows=1000):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = sqlite3.Row
+        self.max_rows = max_rows
+        self.pages = []
+        for table, rows in tables.items():
+            columns = list(rows[0])
+            self.db.execute(f'CREATE TABLE {table} ({", ".join(columns)})')
+            self.db.executemany(f'INSERT INTO {table} VALUES ({", ".join("?" * len(columns))})',
+                                [[row[column] for column in columns] for row in rows])
+
+    def table(self, name):
+        return PostgRESTQuery(self, name)
+
+
+@pytest.fixture
+def postgrest():
+    """Build a PostgREST stand-in from {table: [row dicts]}, optionally with another max_rows cap."""
+    return PostgRESTServer
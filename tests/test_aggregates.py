@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask, g
+
+import graphs
+from aggregates import (DAY_ORDER, TIME_BINS, new_aggregates, update_aggregates, build_aggregates, aggregate_tables,
+                        summarize_aggregates, day_index, range_series, range_totals)
+from cache_utils import set_cached
+
+
+def mood_frame(n, timezones=('UTC',), seed=0):
+    """Mood rows over 2024 shaped like fetch_rows' output. Moods are half steps, so sums are exact in any order."""
+    rng = np.random.default_rng(seed)
+    minutes = np.sort(rng.integers(0, 365 * 24 * 60, n))
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'date': pd.Timestamp('2024-01-01', tz='UTC') + pd.to_timedelta(minutes, unit='m'),
+        'mood': rng.integers(2, 21, n) / 2,
+        'timezone': [timezones[i % len(timezones)] for i in range(n)]
+    })
+
+
+def fold(df):
+    aggregates = new_aggregates()
+    for date, mood, timezone in zip(df['date'], df['mood'], df['timezone']):
+        aggregates = update_aggregates(aggregates, date, mood, timezone)
+    return aggregates
+
+
+def baseline_tables(df):
+    """The per-figure groupbys the dashboard ran over the raw rows before the aggregate store (UTC rows only)."""
+    df = df.assign(date=df['date'].dt.tz_localize(None))
+    df['day_only'] = df['date'].dt.date
+    monthly = df.groupby(df['date'].dt.to_period('M').dt.to_timestamp())['mood'].mean()
+    weekly = df.groupby((df['date'] - pd.to_timedelta(df['date'].dt.weekday, unit='d')).dt.date)['mood'].mean()
+
+    df['Day'] = df['date'].dt.day_name()
+    latest_days = df.groupby('Day')['day_only'].max()
+    recent = df[df['day_only'] == df['Day'].map(latest_days)].groupby('Day')['mood'].mean()
+    day_of_week = df.groupby('Day')['mood'].mean().to_frame('mood_weekly_avg').join(recent.rename('mood_latest_avg'))
+
+    df['time_bin'] = pd.cut(df['date'].dt.hour, bins=TIME_BINS, labels=False, right=False)
+    latest_dates = df.groupby('time_bin')['day_only'].max()
+    latest = df[df['day_only'] == df['time_bin'].map(latest_dates)].groupby('time_bin')['mood'].mean()
+    time_of_day = df.groupby('time_bin')['mood'].mean().to_frame('mood_all_time_avg').join(latest.rename('mood_latest_avg'))
+
+    return monthly, weekly, day_of_week, time_of_day
+
+
+@pytest.fixture
+def index():
+    aggregates = new_aggregates()
+    for date, mood in [('2024-01-03T12:00:00Z', 5), ('2024-01-20T12:00:00Z', 7), ('2024-02-05T12:00:00Z', 3)]:
+        aggregates = update_aggregates(aggregates, date, mood, 'UTC')
+    return day_index(aggregates)
+
+
+def test_range_series_averages_each_period_in_the_range(index):
+    monthly = range_series(index, '2024-01-01', '2024-02-28', 'M')
+    assert monthly['Month Start'].tolist() == [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-02-01')]
+    assert monthly['mood'].tolist() == [6.0, 3.0]
+    weekly = range_series(index, '2024-01-04', '2024-02-28', 'W')
+    assert weekly['Week Start'].astype(str).tolist() == ['2024-01-15', '2024-02-05']
+    assert weekly['mood'].tolist() == [7.0, 3.0]
+
+
+@pytest.mark.parametrize('freq, label', [('M', 'Month Start'), ('W', 'Week Start')])
+def test_an_inverted_range_is_empty(index, freq, label):
+    series = range_series(index, '2024-02-28', '2024-01-01', freq)
+    assert series.empty
+    assert list(series.columns) == [label, 'mood']
+    assert range_totals(index, '2024-02-28', '2024-01-01') == (0.0, 0)
+
+
+def test_folding_entries_one_at_a_time_matches_a_full_build():
+    # Rows in several timezones, across both DST changes
+    df = mood_frame(500, timezones=('America/New_York', 'Asia/Tokyo', 'UTC'))
+    assert fold(df) == build_aggregates(df)
+
+
+@pytest.mark.parametrize('build', [fold, build_aggregates])
+def test_aggregate_tables_match_the_per_figure_groupbys(build):
+    df = mood_frame(500)
+    monthly, weekly, day_of_week, time_of_day = baseline_tables(df)
+    tables = aggregate_tables(build(df))
+
+    assert tables['monthly']['Month Start'].tolist() == monthly.index.tolist()
+    assert tables['monthly']['mood'].tolist() == pytest.approx(monthly.tolist())
+    assert tables['weekly']['Week Start'].tolist() == weekly.index.tolist()
+    assert tables['weekly']['mood'].tolist() == pytest.approx(weekly.tolist())
+
+    day_of_week = day_of_week.reindex([day for day in DAY_ORDER if day in day_of_week.index])
+    assert tables['day_of_week']['Day'].tolist() == day_of_week.index.tolist()
+    for column in ('mood_weekly_avg', 'mood_latest_avg'):
+        assert tables['day_of_week'][column].tolist() == pytest.approx(day_of_week[column].tolist())
+
+    assert tables['time_of_day']['Time of Day'].cat.codes.tolist() == time_of_day.index.tolist()
+    for column in ('mood_all_time_avg', 'mood_latest_avg'):
+        assert tables['time_of_day'][column].tolist() == pytest.approx(time_of_day[column].tolist())
+
+    assert tables['stats']['mood_entries_all_time'] == len(df)
+
+
+@pytest.fixture
+def dashboard_cache():
+    app = Flask(__name__)
+    app.config['CACHE_TYPE'] = 'SimpleCache'
+    graphs.cache.init_app(app)
+    with app.app_context():
+        g.user_uuid = 'u'
+        yield graphs.cache
+
+
+def cache_store(cache, df):
+    """Cache the store for df and the dashboard summary built from it, as a dashboard visit would."""
+    aggregates = set_cached(cache, 'aggregates_cache_u', build_aggregates(df), graphs.AGGREGATES_FRESH_FOR,
+                            graphs.AGGREGATES_TIMEOUT - graphs.AGGREGATES_FRESH_FOR)
+    graphs.load_dashboard_summary(aggregates)
+
+
+@pytest.mark.parametrize('date, backdated', [
+    ('2024-03-10T15:00:00+00:00', True),   # Months before the open month and week
+    ('2024-12-28T23:00:00+00:00', False)   # The open month and week
+])
+def test_record_entry_patches_the_cached_store(dashboard_cache, date, backdated):
+    df = mood_frame(200)
+    df = df[df['date'] < pd.Timestamp('2024-12-28', tz='UTC')]
+    cache_store(dashboard_cache, df)
+
+    entry = {'date': date, 'mood': 1.5, 'timezone': 'UTC'}
+    graphs.record_entry('u', entry)
+
+    rows = pd.concat([df, pd.DataFrame([{**entry, 'id': 1000, 'date': pd.Timestamp(date)}])], ignore_index=True)
+    stored = dashboard_cache.get('aggregates_cache_u')['value']
+    assert stored == build_aggregates(rows)
+    # Only a backdated entry reaches the cached history; either way the dashboard matches a rebuild
+    assert (dashboard_cache.get('graphs_history_cache_u') is None) == backdated
+    assert graphs.load_dashboard_summary(stored) == summarize_aggregates(build_aggregates(rows))
@@ -0,0 +1,98 @@
+import types
+
+import pytest
+
+from utils import batch_utils
+from utils.batch_utils import BatchPending, LocalBatchClient, run_stage, load_state, save_state
+
+
+class EchoChat:
+    """A chat completions client that answers each prompt with itself, and fails prompts containing 'fail'."""
+
+    def __init__(self):
+        self.calls = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, messages, n=1, **params):
+        self.calls.append(messages)
+        prompt = messages[-1]['content']
+        if 'fail' in prompt:
+            raise ValueError('bad request')
+        return types.SimpleNamespace(choices=[
+            types.SimpleNamespace(message=types.SimpleNamespace(content=f'{prompt} #{i}')) for i in range(n)
+        ])
+
+
+class SlowBatchClient(LocalBatchClient):
+    """A LocalBatchClient whose batches report in_progress for their first few polls."""
+
+    def __init__(self, chat_client, pending_polls):
+        super().__init__(chat_client)
+        self.pending_polls = pending_polls
+        self.batches.retrieve = self._retrieve
+
+    def _retrieve(self, batch_id):
+        batch = self._batches[batch_id]
+        if self.pending_polls:
+            self.pending_polls -= 1
+            return types.SimpleNamespace(**{**vars(batch), 'status': 'in_progress'})
+        return batch
+
+
+def request(prompt, n=1):
+    return {'model': 'gpt-4o-mini', 'n': n, 'messages': [{'role': 'user', 'content': prompt}]}
+
+
+def test_run_stage_submits_one_batch_and_collects_results_by_custom_id():
+    chat = EchoChat()
+    state, saves = {'name': 'test'}, []
+    results = run_stage(LocalBatchClient(chat), state, 'drivers', {'a': request('hello', n=2), 'b': request('bye')},
+                        saves.append, poll_interval=0)
+    assert results == {'a': ['hello #0', 'hello #1'], 'b': ['bye #0']}
+    assert len(chat.calls) == 2
+    assert state['stages']['drivers']['results'] == results
+    assert 'batch_id' in state['stages']['drivers']
+    # Saved once the batch was submitted, and again with its results
+    assert len(saves) == 2
+
+
+def test_failed_requests_are_left_out_of_the_results(capsys):
+    results = run_stage(LocalBatchClient(EchoChat()), {}, 'refine', {'a': request('fine'), 'b': request('fail')},
+                        lambda state: None, poll_interval=0)
+    assert results == {'a': ['fine #0']}
+    assert 'Batch request b failed' in capsys.readouterr().out
+
+
+def test_run_stage_resumes_a_pending_batch_without_resubmitting():
+    chat = EchoChat()
+    client = SlowBatchClient(chat, pending_polls=3)
+    state = {}
+    requests = {'a': request('hello')}
+    with pytest.raises(BatchPending):
+        run_stage(client, state, 'summary', requests, lambda state: None, poll_interval=0, timeout=0)
+    batch_id = state['stages']['summary']['batch_id']
+    assert 'results' not in state['stages']['summary']
+
+    assert run_stage(client, state, 'summary', requests, lambda state: None, poll_interval=0) == {'a': ['hello #0']}
+    assert state['stages']['summary']['batch_id'] == batch_id
+    assert len(client._batches) == 1
+    assert len(chat.calls) == 1
+
+    # Once collected, the stage's results come straight from the state
+    assert run_stage(client, state, 'summary', requests, lambda state: None) == {'a': ['hello #0']}
+    assert len(client._batches) == 1
+
+
+def test_run_stage_with_no_requests_submits_nothing():
+    client = LocalBatchClient(EchoChat())
+    assert run_stage(client, {}, 'consolidate', {}, lambda state: None) == {}
+    assert not client._batches
+
+
+def test_run_state_round_trips_through_the_state_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv('REDISCLOUD_URL', raising=False)
+    monkeypatch.setattr(batch_utils, 'BATCH_STATE_DIR', str(tmp_path))
+    assert load_state('daily_batch_2026-10-15') is None
+    save_state('daily_batch_2026-10-15', {'day': '2026-10-15', 'stages': {}})
+    assert load_state('daily_batch_2026-10-15') == {'day': '2026-10-15', 'stages': {}}
+    assert load_state('daily_batch_2026-10-16') is None
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+from flask import Flask
+from flask_caching import Cache
+
+import cache_utils
+from cache_utils import pack, unpack, stale_while_revalidate, set_cached, update_cached
+
+
+@pytest.fixture
+def cache():
+    app = Flask(__name__)
+    app.config['CACHE_TYPE'] = 'SimpleCache'
+    cache = Cache(app)
+    with app.app_context():
+        yield cache
+
+
+def age(cache, key, seconds):
+    entry = cache.get(key)
+    cache.set(key, {**entry, 'stored_at': entry['stored_at'] - seconds})
+
+
+def background_refresh(cache, key, value):
+    """Serve a stale key, starting a refresh that returns value once released; returns (release, finished)."""
+    release, finished = threading.Event(), threading.Event()
+    refresh = cache_utils._refresh
+    def tracked(*args):
+        try:
+            refresh(*args)
+        finally:
+            finished.set()
+    def compute():
+        release.wait(5)
+        return value
+    cache_utils._refresh = tracked
+    try:
+        assert stale_while_revalidate(cache, key, compute, fresh_for=10, max_stale=60) == [1]
+    finally:
+        cache_utils._refresh = refresh
+    return release, finished
+
+
+def test_stale_entries_are_served_while_refreshed_in_the_background(cache):
+    set_cached(cache, 'k', [1], fresh_for=10, max_stale=60)
+    age(cache, 'k', 30)
+    release, finished = background_refresh(cache, 'k', [1, 2])
+    release.set()
+    assert finished.wait(5)
+    assert stale_while_revalidate(cache, 'k', lambda: [0], fresh_for=10, max_stale=60) == [1, 2]
+
+
+def test_a_refresh_that_raced_an_update_is_discarded(cache):
+    set_cached(cache, 'k', [1], fresh_for=10, max_stale=60)
+    age(cache, 'k', 30)
+    # The refresh read its inputs before the update, so its result would lose it
+    release, finished = background_refresh(cache, 'k', [1])
+    update_cached(cache, 'k', lambda value: value + [3], fresh_for=10, max_stale=60)
+    release.set()
+    assert finished.wait(5)
+    assert cache.get('k')['value'] == [1, 3]
+
+
+def test_a_refresh_that_raced_a_delete_is_discarded(cache):
+    set_cached(cache, 'k', [1], fresh_for=10, max_stale=60)
+    age(cache, 'k', 30)
+    release, finished = background_refresh(cache, 'k', [1])
+    cache.delete('k')
+    release.set()
+    assert finished.wait(5)
+    assert cache.get('k') is None
+
+
+def test_packed_entries_read_back_unchanged():
+    summary = {'monthly': {'Month Start': ['2024-01-01', '2024-02-01'], 'mood': [5.5, 6.25]},
+               'stats': {'today_mood': 'No entries today', 'mood_entries_all_time': 2}}
+    assert unpack(pack(summary, 3), 3) == summary
+
+
+def test_entries_from_another_schema_version_read_as_none():
+    assert unpack(pack({'mood': [5.0]}, 1), 2) is None
+
+
+@pytest.mark.parametrize('data', [None, b''])
+def test_missing_entries_read_as_none(data):
+    assert unpack(data, 1) is None
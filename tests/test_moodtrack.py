@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+import supabase
+
+import graphs
+
+
+def use_simple_cache(app):
+    app.config['CACHE_TYPE'] = 'SimpleCache'
+    graphs.cache.init_app(app)
+
+
+@pytest.fixture(scope='module')
+def moodtrack():
+    # The app connects to Supabase and Redis as it's imported
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(supabase, 'create_client', lambda *args, **kwargs: None)
+        patch.setattr(graphs, 'init_cache', use_simple_cache)
+        import moodtrack
+    return moodtrack
+
+
+def mood_entries(user_uuid, count):
+    start = pd.Timestamp('2024-01-01', tz='UTC')
+    return [{'id': i, 'user_uuid': user_uuid, 'date': (start + pd.Timedelta(hours=13 * i)).isoformat(),
+             'mood': 5.0 + i % 3, 'timezone': 'UTC'} for i in range(1, count + 1)]
+
+
+@pytest.fixture
+def client(moodtrack, postgrest, monkeypatch):
+    # Two users whose stores match in entry count, latest day and local date
+    rows = mood_entries('alice', 40) + [{**row, 'id': row['id'] + 1000, 'user_uuid': 'bob'} for row in mood_entries('bob', 40)]
+    server = postgrest({'mood_entries': rows})
+    monkeypatch.setattr(moodtrack, 'create_client', lambda *args, **kwargs: server)
+    monkeypatch.setattr(moodtrack, 'SUPABASE_DB', 'mood_entries')
+    graphs.cache.clear()
+    return moodtrack.app.test_client()
+
+
+def log_in(client, user_uuid):
+    with client.session_transaction() as session:
+        session['user_email'] = f'{user_uuid}@example.com'
+        session['user_uuid'] = user_uuid
+
+
+def test_dashboard_data_revalidates_with_its_etag(client, moodtrack):
+    log_in(client, 'alice')
+    response = client.get('/api/dashboard_data')
+    assert response.status_code == 200
+    assert response.json['stats']['mood_entries_all_time'] == 40
+    assert 'private' in response.headers['Cache-Control']
+    assert response.headers['Vary'] == 'Cookie'
+    etag = response.headers['ETag']
+
+    unchanged = client.get('/api/dashboard_data', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b''
+
+    # A new entry changes the store, so the old copy no longer matches
+    moodtrack.record_entry('alice', {'date': '2024-01-23T12:00:00+00:00', 'mood': 3.0, 'timezone': 'UTC'})
+    changed = client.get('/api/dashboard_data', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.json['stats']['mood_entries_all_time'] == 41
+
+
+def test_another_user_never_matches_the_previous_users_etag(client):
+    log_in(client, 'alice')
+    etag = client.get('/api/dashboard_data').headers['ETag']
+
+    # Log out and in as someone else on the same browser
+    log_in(client, 'bob')
+    response = client.get('/api/dashboard_data', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
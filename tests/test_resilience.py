@@ -0,0 +1,73 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from utils import resilience
+from utils.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceededError, ResilientCaller
+
+
+def error(error_type, status):
+    response = httpx.Response(status, request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+    return error_type('failed', response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, 'backoff_delay', lambda attempt, error=None: 0)
+
+
+def failing(errors, result='ok'):
+    calls = []
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return call, calls
+
+
+def test_rate_limits_back_off_without_opening_the_circuit():
+    caller = ResilientCaller(max_attempts=10, breaker=CircuitBreaker(failure_threshold=3))
+    call, calls = failing([error(openai.RateLimitError, 429)] * 5)
+    acquired = []
+    assert caller(call, before_attempt=lambda: acquired.append(True)) == 'ok'
+    assert len(calls) == len(acquired) == 6
+    assert caller.breaker.opened_at is None
+
+
+def test_server_errors_open_the_circuit():
+    caller = ResilientCaller(max_attempts=10, breaker=CircuitBreaker(failure_threshold=3))
+    call, calls = failing([error(openai.InternalServerError, 500)] * 5)
+    with pytest.raises(CircuitOpenError):
+        caller(call)
+    assert len(calls) == 3
+
+
+def test_a_deadline_spent_waiting_to_attempt_raises_without_a_breaker_failure():
+    caller = ResilientCaller(max_attempts=3, deadline=0.5, breaker=CircuitBreaker(failure_threshold=1))
+    call, calls = failing([])
+    with pytest.raises(DeadlineExceededError):
+        caller(call, before_attempt=lambda: time.sleep(0.6))
+    assert calls == []
+    assert caller.breaker.failures == 0
+    assert caller.breaker.opened_at is None
+
+
+def test_the_primary_attempt_doesnt_queue_behind_a_busy_hedge_pool():
+    caller = ResilientCaller(hedge=True, hedge_workers=1)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        caller.latency.record(0.01)
+    release = threading.Event()
+    caller.hedge_pool.submit(release.wait, 5)
+    started = time.monotonic()
+    try:
+        def call(timeout):
+            time.sleep(0.05)
+            return 'ok'
+        assert caller(call) == 'ok'
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
@@ -0,0 +1,111 @@
+import io
+
+import pandas as pd
+import pytest
+
+from utils import supabase_utils
+from utils.supabase_utils import window_filters, period_start_date, mood_data, fetch_mood_analysis_historical, load_frame
+
+
+@pytest.fixture(autouse=True)
+def table_names(monkeypatch):
+    monkeypatch.setattr(supabase_utils, 'SUPABASE_DB', 'mood_entries')
+    monkeypatch.setattr(supabase_utils, 'SUPABASE_DB_MANALYSIS', 'mood_analysis')
+
+
+def entry(id, date, user_uuid='u', timezone='America/New_York'):
+    return {'id': id, 'user_uuid': user_uuid, 'date': date, 'mood': 5.0, 'description': f'entry {id}', 'timezone': timezone}
+
+
+def analysis(id, date, user_uuid='u'):
+    return {'id': id, 'user_uuid': user_uuid, 'date': date, 'category': 'significant_events',
+            'sub_category': 'Work', 'impact': 'positive', 'description': f'analysis {id}'}
+
+
+def test_window_filters_convert_the_days_to_the_users_utc_bounds():
+    # Run just past midnight: the window is yesterday, a 23-hour day in New York across the DST change
+    assert window_filters('u', 'daily', pd.Timestamp('2026-03-09 00:30'), 'America/New_York') == [
+        ('eq', 'user_uuid', 'u'),
+        ('gte', 'date', '2026-03-08T05:00:00+00:00'),
+        ('lt', 'date', '2026-03-09T04:00:00+00:00'),
+    ]
+
+
+def test_window_filters_use_plain_dates_without_a_timezone():
+    now = pd.Timestamp('2026-03-09 00:30')
+    assert window_filters('u', 'daily', now) == [
+        ('eq', 'user_uuid', 'u'), ('gte', 'date', '2026-03-08'), ('lt', 'date', '2026-03-09'),
+    ]
+    assert window_filters('u', 'weekly', now) == [
+        ('eq', 'user_uuid', 'u'), ('gte', 'date', '2026-03-02'), ('lt', 'date', '2026-03-09'),
+    ]
+
+
+def test_window_filters_leave_all_unwindowed():
+    assert window_filters('u', 'all', pd.Timestamp('2026-03-09')) == [('eq', 'user_uuid', 'u')]
+
+
+def test_a_pacific_user_gets_the_runs_day_and_week():
+    # The nightly run at 00:30 Eastern on Monday the 9th, when it is still Sunday evening in Los Angeles.
+    # The run's date picks the period, matching the summary file names the downloads look for
+    now = pd.Timestamp('2026-03-09 00:30', tz='US/Eastern').tz_localize(None)
+    assert period_start_date('daily', now) == '2026-03-08'
+    assert period_start_date('weekly', now) == '2026-03-02'
+    assert window_filters('u', 'daily', now, 'America/Los_Angeles') == [
+        ('eq', 'user_uuid', 'u'),
+        ('gte', 'date', '2026-03-08T08:00:00+00:00'),
+        ('lt', 'date', '2026-03-09T07:00:00+00:00'),
+    ]
+    assert window_filters('u', 'weekly', now, 'America/Los_Angeles') == [
+        ('eq', 'user_uuid', 'u'),
+        ('gte', 'date', '2026-03-02T08:00:00+00:00'),
+        ('lt', 'date', '2026-03-09T07:00:00+00:00'),
+    ]
+    assert window_filters('u', 'daily', now) == [
+        ('eq', 'user_uuid', 'u'), ('gte', 'date', '2026-03-08'), ('lt', 'date', '2026-03-09'),
+    ]
+
+
+def test_mood_data_includes_the_start_of_the_window_and_excludes_its_end(postgrest):
+    supabase = postgrest({'mood_entries': [
+        entry(1, '2026-03-08T04:59:59+00:00'),  # 23:59:59 the day before
+        entry(2, '2026-03-08T05:00:00+00:00'),  # local midnight, the window's start
+        entry(3, '2026-03-09T03:59:59+00:00'),  # 23:59:59 local, the last second in the window
+        entry(4, '2026-03-09T04:00:00+00:00'),  # local midnight, the window's end
+        entry(5, '2026-03-08T12:00:00+00:00', user_uuid='someone else'),
+    ]})
+    csv = mood_data('daily', 'u', supabase=supabase, now=pd.Timestamp('2026-03-09 00:30'))
+    df = pd.read_csv(io.StringIO(csv))
+    assert df['description'].tolist() == ['entry 2', 'entry 3']
+    assert df['date'].tolist() == ['2026-03-08 00:00:00', '2026-03-08 23:59:59']
+
+
+def test_fetch_mood_analysis_historical_windows_on_plain_dates(postgrest):
+    supabase = postgrest({'mood_analysis': [
+        analysis(1, '2026-03-01'), analysis(2, '2026-03-02'), analysis(3, '2026-03-08'), analysis(4, '2026-03-09'),
+        analysis(5, '2026-03-08', user_uuid='someone else'),
+    ]})
+    now = pd.Timestamp('2026-03-09 00:30')
+    daily = fetch_mood_analysis_historical('u', 'daily', supabase=supabase, now=now)
+    weekly = fetch_mood_analysis_historical('u', 'weekly', supabase=supabase, now=now)
+    assert daily['id'].tolist() == [3]
+    assert weekly['id'].tolist() == [2, 3]
+    assert fetch_mood_analysis_historical('u', supabase=supabase)['id'].tolist() == [1, 2, 3, 4]
+
+
+def test_mood_data_pages_past_the_server_cap(postgrest):
+    start = pd.Timestamp('2026-03-08T05:00:00', tz='UTC')
+    rows = [entry(id, (start + pd.Timedelta(seconds=30 * id)).isoformat()) for id in range(1, 2501)]
+    supabase = postgrest({'mood_entries': rows})
+    csv = mood_data('daily', 'u', supabase=supabase, now=pd.Timestamp('2026-03-09 00:30'), user_timezone='America/New_York')
+    assert len(pd.read_csv(io.StringIO(csv))) == 2500
+    assert supabase.pages == [1000, 1000, 500]
+
+
+@pytest.mark.parametrize('max_rows', [1000, 300])
+def test_load_frame_reads_every_row_whatever_the_page_cap(postgrest, max_rows):
+    rows = [analysis(id, '2026-03-08', user_uuid='u' if id % 5 else 'someone else') for id in range(1, 2501)]
+    supabase = postgrest({'mood_analysis': rows}, max_rows=max_rows)
+    df = load_frame(supabase, 'mood_analysis', ['id', 'date'], [('eq', 'user_uuid', 'u')], dtypes={'id': 'int64'})
+    assert df['id'].tolist() == [id for id in range(1, 2501) if id % 5]
+    assert max(supabase.pages) == max_rows
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from utils.time_utils import local_times, localize_local_times, parse_utc_dates
+
+
+def test_local_times_converts_each_row_in_its_own_timezone():
+    dates = pd.Series(pd.to_datetime(['2024-01-01T12:00:00Z', '2024-07-01T12:00:00Z'], utc=True))
+    timezones = pd.Series(['America/New_York', 'Europe/Berlin'])
+    local = local_times(dates, timezones)
+    assert local.tolist() == [pd.Timestamp('2024-01-01 07:00'), pd.Timestamp('2024-07-01 14:00')]
+
+
+def test_null_timezones_fall_back_to_utc():
+    dates = pd.Series(pd.to_datetime(['2024-01-01T12:00:00Z'] * 3, utc=True))
+    for timezones in (pd.Series(['America/New_York', None, float('nan')]),
+                      pd.Series(['America/New_York', None, None], dtype='category')):
+        local = local_times(dates, timezones)
+        assert local.tolist() == [pd.Timestamp('2024-01-01 07:00'), pd.Timestamp('2024-01-01 12:00'),
+                                  pd.Timestamp('2024-01-01 12:00')]
+        assert localize_local_times(local, timezones).tolist() == dates.tolist()
+
+
+def test_parse_utc_dates_localizes_legacy_rows_with_null_timezone():
+    dates = pd.Series(['2024-01-01T12:00:00+00:00', '01/01/2024 07:00', '01/01/2024 07:00'])
+    timezones = pd.Series(['UTC', 'America/New_York', None])
+    parsed = parse_utc_dates(dates, timezones)
+    assert parsed.tolist() == [pd.Timestamp('2024-01-01 12:00', tz='UTC'), pd.Timestamp('2024-01-01 12:00', tz='UTC'),
+                               pd.Timestamp('2024-01-01 07:00', tz='UTC')]
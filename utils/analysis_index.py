@@ -0,0 +1,168 @@
+# Standard library imports
+import io
+import os
+import re
+import zlib
+
+# Third-party library imports
+import numpy as np
+import redis
+from dotenv import load_dotenv
+
+# Local module imports
+from utils.run_agreement import CATEGORIES, STOPWORDS, parse_run
+
+load_dotenv()
+
+# The refine prompt carries the RETRIEVAL_TOP_K historical rows most similar to the day's
+# drivers (0 sends the whole history). Indexes are kept in Redis when REDISCLOUD_URL is set,
+# else in ANALYSIS_INDEX_DIR
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 20))
+ANALYSIS_INDEX_DIR = os.getenv('ANALYSIS_INDEX_DIR', '.analysis_index')
+
+# Word unigrams and bigrams are hashed into this many TF-IDF dimensions
+INDEX_DIMENSIONS = 1024
+
+
+def row_text(row):
+    return f"{row['category']} {row['sub_category']} {row['description']}"
+
+
+def term_vectors(texts):
+    """Hashed word and word-pair counts (log-scaled) of each text, one row per text."""
+    vectors = np.zeros((len(texts), INDEX_DIMENSIONS), dtype=np.float32)
+    for i, text in enumerate(texts):
+        words = [word for word in re.findall(r"[a-z]+", str(text).lower().replace('_', ' '))
+                 if len(word) > 2 and word not in STOPWORDS]
+        # crc32 rather than hash(), which is salted per process
+        for term in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            vectors[i, zlib.crc32(term.encode('utf-8')) % INDEX_DIMENSIONS] += 1
+    return np.log1p(vectors)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class AnalysisIndex:
+    """A user's mood analysis rows as hashed term vectors, searchable by TF-IDF cosine similarity."""
+
+    def __init__(self, ids=None, vectors=None):
+        self.ids = np.asarray(ids if ids is not None else [], dtype=np.int64)
+        self.vectors = vectors if vectors is not None else np.zeros((0, INDEX_DIMENSIONS), dtype=np.float32)
+
+    def add(self, rows):
+        """Index rows (dicts with id, category, sub_category and description), replacing any with the same id."""
+        ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        self.remove(ids)
+        self.ids = np.concatenate([self.ids, ids])
+        self.vectors = np.vstack([self.vectors, term_vectors([row_text(row) for row in rows])])
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids, np.asarray(list(ids), dtype=np.int64))
+        self.ids, self.vectors = self.ids[keep], self.vectors[keep]
+
+    def search(self, queries, k):
+        """Ids of the k rows most similar to any of the query texts, best first."""
+        if not len(self.ids):
+            return []
+        # Document frequencies come from the rows themselves, so adding rows needs no refit
+        document_frequency = (self.vectors > 0).sum(axis=0)
+        idf = np.log((1 + len(self.ids)) / (1 + document_frequency)) + 1
+        scores = (_normalize(term_vectors(queries) * idf) @ _normalize(self.vectors * idf).T).max(axis=0)
+        return self.ids[np.argsort(-scores, kind='stable')[:k]].tolist()
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, ids=self.ids, vectors=self.vectors.astype(np.float16))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data))
+        return cls(arrays['ids'], arrays['vectors'].astype(np.float32))
+
+
+## Storage: one index per user, in Redis or on disk
+def _index_path(user_uuid):
+    return os.path.join(ANALYSIS_INDEX_DIR, f'{user_uuid}.npz')
+
+
+def load_index(user_uuid):
+    redis_url = os.getenv('REDISCLOUD_URL')
+    if redis_url:
+        data = redis.Redis.from_url(redis_url).get(f'analysis_index:{user_uuid}')
+    else:
+        try:
+            with open(_index_path(user_uuid), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = None
+    return AnalysisIndex.from_bytes(data) if data else AnalysisIndex()
+
+
+def save_index(user_uuid, index):
+    redis_url = os.getenv('REDISCLOUD_URL')
+    if redis_url:
+        # Dropped after a month without updates; it's rebuilt from the table when next needed
+        redis.Redis.from_url(redis_url).set(f'analysis_index:{user_uuid}', index.to_bytes(), ex=30 * 86400)
+        return
+    os.makedirs(ANALYSIS_INDEX_DIR, exist_ok=True)
+    path = _index_path(user_uuid)
+    with open(path + '.tmp', 'wb') as file:
+        file.write(index.to_bytes())
+    os.replace(path + '.tmp', path)
+
+
+def index_rows(user_uuid, rows):
+    """Add newly inserted mood analysis rows to the user's index. Failures are logged; the next search catches up."""
+    try:
+        index = load_index(user_uuid)
+        index.add(rows)
+        save_index(user_uuid, index)
+    except Exception as e:
+        print(f"Failed to index mood analysis rows for {user_uuid}: {e}")
+
+
+def unindex_rows(user_uuid, ids):
+    """Drop deleted mood analysis rows from the user's index. Failures are logged; the next search catches up."""
+    try:
+        index = load_index(user_uuid)
+        index.remove(ids)
+        save_index(user_uuid, index)
+    except Exception as e:
+        print(f"Failed to unindex mood analysis rows for {user_uuid}: {e}")
+
+
+def driver_queries(drivers_content):
+    """One query text per driver in a CHAIN 2/3 JSON reply, or the whole reply if it doesn't parse."""
+    run = parse_run(drivers_content)
+    run = run if isinstance(run, dict) else {}
+    queries = [f"{category} {item.get('sub_category', '')} {item.get('description', '')}"
+               for category in CATEGORIES for item in run.get(category) or [] if isinstance(item, dict)]
+    return queries or [drivers_content]
+
+
+def relevant_history(user_uuid, historical, drivers_content, k=RETRIEVAL_TOP_K):
+    """The k rows of a user's analysis history (DataFrame) most similar to the day's drivers, in date order.
+
+    The index is first brought in line with the rows passed in, so rows written or deleted
+    without going through index_rows/unindex_rows are still accounted for.
+    """
+    if k <= 0 or len(historical) <= k:
+        return historical
+    try:
+        index = load_index(user_uuid)
+        missing = historical[~historical['id'].isin(index.ids)]
+        stale = set(index.ids.tolist()) - set(historical['id'].tolist())
+        if len(missing) or stale:
+            index.remove(stale)
+            if len(missing):
+                index.add(missing.to_dict('records'))
+            save_index(user_uuid, index)
+    except Exception as e:
+        # Fall back to the whole history; the refine stage's token budget still applies
+        print(f"Analysis index unavailable for {user_uuid}: {e}")
+        return historical
+    return historical[historical['id'].isin(index.search(driver_queries(drivers_content), k))]
@@ -1,20 +1,36 @@
 # Standard library imports
 import os
 import sys
-from datetime import timezone, datetime
+import time
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timezone, datetime, timedelta
 
 # Third-party library imports
+import numpy as np
 import pandas as pd
 import pytz
-import json
-import re
 from dotenv import load_dotenv
+from flask import Flask
 from supabase import create_client, Client
 
-# Local imports
+# Local imports. The repo root holds the web app's modules (graphs) and the utils package the
+# helpers import from, so it's made importable first, whatever directory the job is run from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from supabase_storage_utils import upload_mood_summary_to_supabase
-from openai_utils import mood_summary, mood_analysis_pipeline, weekly_manalysis_trimming
-from supabase_utils import mood_data, insert_manalysis_to_supabase, delete_manalysis_rows_from_supabase
+from openai_utils import (
+    mood_summary, mood_analysis_pipeline, weekly_manalysis_trimming, prompt_cache_hit_rate,
+    openai_client, chat_request, parse_json_result,
+    drivers_num_runs, drivers_messages, consolidate_messages, refine_messages, summary_messages, empty_summary
+)
+from utils.llm_cache import get_cached_response, cache_response
+from utils.context_builder import cut_summary
+from supabase_utils import (
+    mood_data, insert_manalysis_to_supabase, stream_rows,
+    fetch_mood_analysis_historical, period_start_date
+)
+from batch_utils import LocalBatchClient, BatchPending, run_stage, load_state, save_state
+from graphs import init_cache, warm_dashboard_caches
 
 
 # Load environment variables from .env file
@@ -27,50 +43,124 @@ SUPABASE_DB = os.getenv('SUPABASE_DB')
 SUPABASE_DB_MANALYSIS = os.getenv('SUPABASE_DB_MANALYSIS')
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY)
 
-def run_mood_summary(period):
-    # Get list of all unique user UUIDs
-    user_uuids = get_all_user_uuids()  # You'll need to implement this function
+# How many users run_mood_summary processes at once
+USER_CONCURRENCY = int(os.getenv('USER_CONCURRENCY', 4))
+
+# Dashboard pre-warming: users with an entry in the last PREWARM_ACTIVE_DAYS days, PREWARM_WORKERS at a time
+PREWARM_ACTIVE_DAYS = int(os.getenv('PREWARM_ACTIVE_DAYS', 14))
+PREWARM_WORKERS = int(os.getenv('PREWARM_WORKERS', 4))
+
+def in_run_window(current_datetime, period):
+    # Between 12:00 AM and 12:21 AM US/Eastern (Mondays only for weekly) ... adding 1 hour just in case... cause heroku is sketch
+    in_window = current_datetime.time() >= pd.Timestamp('00:00:00').time() and current_datetime.time() <= pd.Timestamp('01:21:00').time()
+    if period == 'weekly':
+        return in_window and current_datetime.weekday() == 0
+    return in_window
+
+
+def run_mood_summary(period, concurrency=USER_CONCURRENCY):
+    """Run the daily or weekly job for every user, `concurrency` users at a time.
+
+    A failure for one user is logged and doesn't stop the others. Returns a run summary
+    (users processed, ids that failed, wall-clock seconds, p99 seconds per user), which
+    is also printed.
+    """
     # Get current date and time, convert to EDT
     current_datetime = pd.to_datetime(datetime.now(timezone.utc).replace(tzinfo=None)).tz_localize(pytz.utc).tz_convert(pytz.timezone('US/Eastern'))
-    day_of_week = current_datetime.weekday()
-
-    for user_uuid in user_uuids:
-        if period == 'weekly':
-            # Check if it's Monday and between 12:00 AM and 12:21 AM ... adding 1 hour just in case... cause heroku is sketch 
-            if day_of_week == 0 and current_datetime.time() >= pd.Timestamp('00:00:00').time() and current_datetime.time() <= pd.Timestamp('01:21:00').time():
-                # Step 1: Summarize the weekly mood data using OpenAI
-                mood_summary_text = mood_summary(user_uuid, 'weekly')
-    
-                # Step 2: Get the last week's Monday as a string
-                last_monday_str = (current_datetime - pd.Timedelta(days=current_datetime.weekday() + 7)).strftime('%Y-%m-%d')
-    
-                # Step 3: Save the summary to a temporary file, Upload the file to Supabase storage
-                temp_filename = f'weeklysummary_{user_uuid}_{last_monday_str}.txt'
-                save_and_upload_summary(temp_filename, mood_summary_text, user_uuid)
-
-                # Step 4: Perform weekly trimming for mood analysis table
-                weekly_manalysis_trimming(user_uuid)
-                
-
-        elif period == 'daily':
-            # Check if it's between 12:00 AM and 12:21 AM
-            if current_datetime.time() >= pd.Timestamp('00:00:00').time() and current_datetime.time() <= pd.Timestamp('01:21:00').time():
-                # Step 1: Run mood analysis pipeline and insert analysis results
-                run_mood_analysis_and_insert(user_uuid)
-        
-                # Step 2: Summarize the daily mood data using OpenAI
-                mood_summary_text = mood_summary(user_uuid, 'daily')
-        
-                # Step 3: Get the date for yesterday
-                start_of_last_day = (current_datetime - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
-        
-                # Step 4: Save the summary to a temporary file, Upload the file to Supabase storage
-                temp_filename = f'dailysummary_{user_uuid}_{start_of_last_day}.txt'
-                save_and_upload_summary(temp_filename, mood_summary_text, user_uuid)
-
-def run_mood_analysis_and_insert(user_uuid):
+    if not in_run_window(current_datetime, period):
+        print(f"Outside the {period} run window, nothing to do.")
+        return None
+
+    # Get list of all unique user UUIDs
+    user_uuids = get_all_user_uuids()
+    process_user = process_weekly_user if period == 'weekly' else process_daily_user
+
+    def timed(user_uuid):
+        user_started = time.perf_counter()
+        try:
+            process_user(user_uuid, current_datetime)
+        finally:
+            user_seconds.append(time.perf_counter() - user_started)
+
+    started = time.perf_counter()
+    failed = []
+    user_seconds = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(timed, user_uuid): user_uuid for user_uuid in user_uuids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"The {period} run failed for user {futures[future]}: {e}")
+
+    summary = {
+        'period': period,
+        'users': len(user_uuids),
+        'succeeded': len(user_uuids) - len(failed),
+        'failed': failed,
+        'seconds': round(time.perf_counter() - started, 1),
+        # The slowest users' chains, which retries and hedging are there to bring down
+        'p99_user_seconds': round(float(np.percentile(user_seconds, 99)), 1) if user_seconds else 0.0,
+        # Share of prompt tokens the provider served from its prompt cache
+        'prompt_cache_hit_rate': prompt_cache_hit_rate(),
+        # Per stage, the share of context tokens left out to fit the token budgets
+        'context_cut': cut_summary()
+    }
+    print(f"{period.capitalize()} run finished: {summary['succeeded']} of {summary['users']} users succeeded "
+          f"in {summary['seconds']}s with up to {concurrency} at a time (p99 per user {summary['p99_user_seconds']}s).")
+    if failed:
+        print(f"Failed users: {', '.join(failed)}")
+    if summary['prompt_cache_hit_rate'] is not None:
+        print(f"Prompt cache hit rate: {summary['prompt_cache_hit_rate']:.0%} of prompt tokens.")
+    if summary['context_cut']:
+        print("Context cut to fit budgets: " + ", ".join(f"{stage} {share:.0%}" for stage, share in summary['context_cut'].items()))
+
+    # Once the daily run is done, warm the dashboards so the first visit of the morning isn't a cold load
+    if period == 'daily':
+        prewarm_dashboards()
+    return summary
+
+
+def process_weekly_user(user_uuid, current_datetime):
+    # The run's Eastern date picks the week, as the summary downloads expect; each user's own
+    # timezone only sets where its days start and end
+    now = current_datetime.tz_localize(None)
+
+    # Step 1: Summarize the weekly mood data using OpenAI
+    mood_summary_text = mood_summary(user_uuid, 'weekly', now)
+
+    # Step 2: Get the last week's Monday as a string
+    last_monday_str = period_start_date('weekly', now)
+
+    # Step 3: Save the summary to a temporary file, Upload the file to Supabase storage
+    temp_filename = f'weeklysummary_{user_uuid}_{last_monday_str}.txt'
+    save_and_upload_summary(temp_filename, mood_summary_text, user_uuid)
+
+    # Step 4: Perform weekly trimming for mood analysis table
+    weekly_manalysis_trimming(user_uuid, now)
+
+
+def process_daily_user(user_uuid, current_datetime):
+    # The run's Eastern date picks the day, so the analysis, the summary and its file name all cover the same one
+    now = current_datetime.tz_localize(None)
+
+    # Step 1: Run mood analysis pipeline and insert analysis results
+    run_mood_analysis_and_insert(user_uuid, now)
+
+    # Step 2: Summarize the daily mood data using OpenAI
+    mood_summary_text = mood_summary(user_uuid, 'daily', now)
+
+    # Step 3: Get the date for yesterday
+    start_of_last_day = period_start_date('daily', now)
+
+    # Step 4: Save the summary to a temporary file, Upload the file to Supabase storage
+    temp_filename = f'dailysummary_{user_uuid}_{start_of_last_day}.txt'
+    save_and_upload_summary(temp_filename, mood_summary_text, user_uuid)
+
+def run_mood_analysis_and_insert(user_uuid, now=None):
     # Collect daily mood data
-    mood_data_csv = mood_data('daily', user_uuid)
+    mood_data_csv = mood_data('daily', user_uuid, now=now)
 
     # Run mood analysis pipeline
     mood_analysis_json = mood_analysis_pipeline(mood_data_csv, user_uuid)
@@ -87,6 +177,169 @@ def get_all_user_uuids():
     return user_uuids
 
 
+def get_active_user_uuids(days):
+    # Users with at least one entry in the last `days` days
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat(timespec='seconds')
+    user_uuids = set()
+    for rows, _ in stream_rows(supabase, SUPABASE_DB, ['id', 'user_uuid'], [('gte', 'date', since)]):
+        user_uuids.update(row['user_uuid'] for row in rows)
+    return user_uuids
+
+
+def prewarm_dashboards(days=PREWARM_ACTIVE_DAYS, workers=PREWARM_WORKERS):
+    """Fill the dashboard caches (rows, aggregate store, graph summary) of recently active users.
+
+    Runs on a bounded thread pool against the same Redis cache and keys as the web app;
+    a failure for one user is logged and doesn't stop the others.
+    """
+    app = Flask(__name__)
+    init_cache(app)
+
+    def warm(user_uuid):
+        with app.app_context():
+            warm_dashboard_caches(supabase, SUPABASE_DB, user_uuid)
+
+    user_uuids = get_active_user_uuids(days)
+    warmed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(warm, user_uuid): user_uuid for user_uuid in user_uuids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                warmed += 1
+            except Exception as e:
+                print(f"Failed to pre-warm dashboard for {futures[future]}: {e}")
+    print(f"Pre-warmed dashboards for {warmed} of {len(user_uuids)} active users.")
+
+
+def run_batch_mood_summary(period='daily', client=None):
+    """Run the daily job for every user through the OpenAI Batch API instead of real-time calls.
+
+    Each chain stage (drivers, consolidate, refine, summary) is one batch covering all
+    users, whose results feed the users' next stage. Progress is saved after every step,
+    under the day the run covers, so if a batch outlasts this run (BATCH_TIMEOUT), the next
+    invocation that day resumes it, even outside the run window, while a run left
+    unfinished on an earlier day never holds up a later one. Requests already in the LLM
+    response cache skip the batch.
+    """
+    if period != 'daily':
+        print("Batch mode runs the daily chain; run the weekly job without --batch.")
+        return None
+    client = client or openai_client
+
+    current_datetime = pd.to_datetime(datetime.now(timezone.utc).replace(tzinfo=None)).tz_localize(pytz.utc).tz_convert(pytz.timezone('US/Eastern'))
+    now = current_datetime.tz_localize(None)
+    day = period_start_date(period, now)
+    name = f'{period}_batch_{day}'
+    state = load_state(name)
+    if state is None:
+        if not in_run_window(current_datetime, period):
+            print(f"Outside the {period} run window, nothing to do.")
+            return None
+        # Inputs are captured once, so a resumed run sees the same logs as the stages before it. The
+        # run time is kept too, so a resumed run's summaries cover the same day as its logs
+        state = {'name': name, 'day': day, 'finished': False, 'now': now.isoformat(),
+                 'mood_data': {user_uuid: mood_data(period, user_uuid, now=now) for user_uuid in get_all_user_uuids()}}
+        save_state(name, state)
+    elif state.get('finished'):
+        print(f"The {period} batch run for {day} already finished.")
+        return state['summary']
+
+    started = time.perf_counter()
+    save = lambda state: save_state(name, state)
+    users = {user_uuid: csv for user_uuid, csv in state['mood_data'].items() if not pd.read_csv(StringIO(csv)).empty}
+    now = pd.Timestamp(state['now'])
+    try:
+        ## CHAIN 1: all capped runs in one request per user (adaptive early stopping needs a round trip per batch)
+        runs = batch_stage(client, state, 'drivers', save, lambda: {
+            user_uuid: (drivers_messages(csv), drivers_num_runs(csv)) for user_uuid, csv in users.items()
+        })
+        ## CHAIN 2: Consolidate Runs
+        consolidated = batch_stage(client, state, 'consolidate', save, lambda: {
+            user_uuid: (consolidate_messages(contents), 1) for user_uuid, contents in runs.items()
+        })
+        ## CHAIN 3: Refine against each user's historicals
+        refined = batch_stage(client, state, 'refine', save, lambda: {
+            user_uuid: (refine_messages(contents[0], fetch_mood_analysis_historical(user_uuid, period='all'), user_uuid), 1)
+            for user_uuid, contents in consolidated.items()
+        })
+
+        # Insert each user's analysis once, before the summaries read it back
+        inserted = state.setdefault('inserted', [])
+        for user_uuid, contents in refined.items():
+            if user_uuid in inserted:
+                continue
+            mood_analysis_json = parse_json_result(contents[0])
+            if mood_analysis_json:
+                insert_manalysis_to_supabase(mood_analysis_json, user_uuid)
+            inserted.append(user_uuid)
+            save(state)
+
+        ## Summaries, for every user; quiet users get the empty template
+        def summary_prompts():
+            messages = {user_uuid: summary_messages(csv, fetch_mood_analysis_historical(user_uuid, period=period, now=now), period)
+                        for user_uuid, csv in state['mood_data'].items()}
+            state['empty_summaries'] = [user_uuid for user_uuid, m in messages.items() if m is None]
+            return {user_uuid: (m, 1) for user_uuid, m in messages.items() if m is not None}
+
+        summaries = batch_stage(client, state, 'summary', save, summary_prompts)
+        summaries = {**{user_uuid: empty_summary(period) for user_uuid in state['empty_summaries']},
+                     **{user_uuid: contents[0] for user_uuid, contents in summaries.items()}}
+
+        uploaded = state.setdefault('uploaded', [])
+        for user_uuid, text in summaries.items():
+            if user_uuid not in uploaded:
+                save_and_upload_summary(f'dailysummary_{user_uuid}_{day}.txt', text, user_uuid)
+                uploaded.append(user_uuid)
+                save(state)
+    except BatchPending as e:
+        print(f"{e}; the next run will resume it.")
+        return None
+
+    # A user failed if a stage's request for them failed, leaving them without an analysis or summary
+    failed = sorted(set(state['mood_data']) - set(state['uploaded']) | set(users) - set(state['inserted']))
+    state['summary'] = {
+        'period': period,
+        'users': len(state['mood_data']),
+        'succeeded': len(state['mood_data']) - len(failed),
+        'failed': failed,
+        'seconds': round(time.perf_counter() - started, 1),
+        'context_cut': cut_summary()
+    }
+    state['finished'] = True
+    save(state)
+    print(f"{period.capitalize()} batch run finished: {state['summary']['succeeded']} of {state['summary']['users']} users succeeded.")
+    if failed:
+        print(f"Failed users: {', '.join(failed)}")
+
+    prewarm_dashboards()
+    return state['summary']
+
+
+def batch_stage(client, state, stage, save, prompts):
+    """Run a stage's prompts (prompts() gives {custom id: (messages, n)}) as a batch, answering cached ones without it.
+
+    Batch requests use the same bodies as the real-time calls, so both share the LLM response cache.
+    """
+    record = state.setdefault('stages', {}).setdefault(stage, {})
+    if 'results' in record:
+        return record['results']
+    cached, requests, keys = {}, {}, {}
+    for custom_id, (messages, n) in prompts().items():
+        keys[custom_id], body = chat_request(messages, n)
+        contents = get_cached_response(keys[custom_id])
+        if contents is None:
+            requests[custom_id] = body
+        else:
+            cached[custom_id] = contents
+    results = run_stage(client, state, stage, requests, save)
+    for custom_id, contents in results.items():
+        cache_response(keys[custom_id], contents)
+    record['results'] = {**cached, **results}
+    save(state)
+    return record['results']
+
+
 def save_and_upload_summary(filename, content, user_uuid):
     with open(filename, 'w') as file:
         file.write(content)
@@ -95,11 +348,15 @@ def save_and_upload_summary(filename, content, user_uuid):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        summary_type = sys.argv[1]
-        if summary_type in ["daily", "weekly"]:
-            run_mood_summary(summary_type)
-        else:
+    # --batch runs the daily chain through the Batch API; --local swaps in the local stand-in for it
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if args:
+        summary_type = args[0]
+        if summary_type not in ["daily", "weekly"]:
             print("Invalid argument. Use 'daily' or 'weekly'.")
+        elif '--batch' in sys.argv:
+            run_batch_mood_summary(summary_type, LocalBatchClient(openai_client) if '--local' in sys.argv else None)
+        else:
+            run_mood_summary(summary_type)
     else:
         print("Please provide 'daily' or 'weekly' as an argument.")
\ No newline at end of file
@@ -0,0 +1,184 @@
+# Standard library imports
+import io
+import json
+import os
+import time
+import types
+import uuid
+
+# Third-party library imports
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How often to check on a submitted batch, and how long to wait before giving up on this run
+# (a later run resumes polling the same batch). Run state is kept in Redis when REDISCLOUD_URL
+# is set, so a resumed run may be on another dyno, else in BATCH_STATE_DIR
+BATCH_POLL_INTERVAL = int(os.getenv('BATCH_POLL_INTERVAL', 60))
+BATCH_TIMEOUT = int(os.getenv('BATCH_TIMEOUT', 3000))
+BATCH_STATE_DIR = os.getenv('BATCH_STATE_DIR', '.batch_runs')
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class BatchPending(Exception):
+    """A batch didn't finish within the timeout; its id is in the run state, so a later run can resume it."""
+
+
+def batch_lines(requests):
+    """JSONL input for the Batch API: one chat completion request per custom id."""
+    return "".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n"
+        for custom_id, body in requests.items()
+    )
+
+
+def submit_batch(client, requests, metadata=None):
+    """Upload the requests as a JSONL file and start a batch over them; returns the batch id."""
+    input_file = client.files.create(file=('batch.jsonl', io.BytesIO(batch_lines(requests).encode('utf-8'))), purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window='24h',
+        metadata=metadata or {}
+    )
+    return batch.id
+
+
+def wait_for_batch(client, batch_id, poll_interval=BATCH_POLL_INTERVAL, timeout=BATCH_TIMEOUT):
+    """Poll a batch until it finishes; raises BatchPending if it's still running after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if time.monotonic() >= deadline:
+            raise BatchPending(f"Batch {batch_id} is still {batch.status}")
+        time.sleep(poll_interval)
+
+
+def batch_results(client, batch):
+    """The choices' contents of each request that succeeded, by custom id. Failed requests are logged and left out."""
+    results = {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                print(f"Batch request {record['custom_id']} failed: {record.get('error') or response.get('body')}")
+                continue
+            results[record['custom_id']] = [choice['message']['content'] for choice in response['body']['choices']]
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                print(f"Batch request {record['custom_id']} failed: {record.get('error') or record.get('response')}")
+    if batch.status != 'completed':
+        print(f"Batch {batch.id} ended {batch.status}; {len(results)} requests have results.")
+    return results
+
+
+def run_stage(client, state, stage, requests, save, **wait_kwargs):
+    """Run one chain stage's requests as a batch and return their results by custom id.
+
+    Resumable: the batch id is saved before polling and the results once collected, so
+    calling this again with the same state picks up where the last run stopped instead
+    of submitting the stage again.
+    """
+    stages = state.setdefault('stages', {})
+    record = stages.setdefault(stage, {})
+    if 'results' in record:
+        return record['results']
+    if not requests:
+        record['results'] = {}
+        save(state)
+        return record['results']
+
+    if 'batch_id' not in record:
+        record['batch_id'] = submit_batch(client, requests, metadata={'run': state.get('name', ''), 'stage': stage})
+        save(state)
+        print(f"Submitted {len(requests)} {stage} requests as batch {record['batch_id']}.")
+
+    batch = wait_for_batch(client, record['batch_id'], **wait_kwargs)
+    record['results'] = batch_results(client, batch)
+    save(state)
+    return record['results']
+
+
+## Run state: a JSON document per run name, in Redis or on disk
+def _state_path(name):
+    return os.path.join(BATCH_STATE_DIR, f'{name}.json')
+
+
+def load_state(name):
+    redis_url = os.getenv('REDISCLOUD_URL')
+    if redis_url:
+        value = redis.Redis.from_url(redis_url).get(f'batch_run:{name}')
+        return json.loads(value) if value else None
+    try:
+        with open(_state_path(name), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(name, state):
+    redis_url = os.getenv('REDISCLOUD_URL')
+    if redis_url:
+        # Kept past the batch completion window so an interrupted run can still resume
+        redis.Redis.from_url(redis_url).set(f'batch_run:{name}', json.dumps(state), ex=7 * 86400)
+        return
+    os.makedirs(BATCH_STATE_DIR, exist_ok=True)
+    # Written to a temporary file first, so an interrupted write can't leave a truncated state
+    path = _state_path(name)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+    os.replace(path + '.tmp', path)
+
+
+class LocalBatchClient:
+    """A stand-in for the Batch API endpoints that runs each request through a chat completions client.
+
+    Implements the files and batches calls used here, so the batch runner can be
+    exercised locally or in tests without waiting on OpenAI's batch queue.
+    """
+
+    def __init__(self, chat_client):
+        self.chat_client = chat_client
+        self._files = {}
+        self._batches = {}
+        self.files = types.SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = types.SimpleNamespace(create=self._create_batch, retrieve=self._batches.__getitem__)
+
+    def _create_file(self, file, purpose):
+        name, content = file
+        file_id = f'file-{uuid.uuid4().hex}'
+        self._files[file_id] = content.read().decode('utf-8')
+        return types.SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id):
+        return types.SimpleNamespace(text=self._files[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        output = []
+        for line in self._files[input_file_id].splitlines():
+            request = json.loads(line)
+            try:
+                response = self.chat_client.chat.completions.create(**request['body'])
+                choices = [{'index': i, 'message': {'role': 'assistant', 'content': choice.message.content}}
+                           for i, choice in enumerate(response.choices)]
+                output.append({'custom_id': request['custom_id'], 'error': None,
+                               'response': {'status_code': 200, 'body': {'choices': choices}}})
+            except Exception as e:
+                output.append({'custom_id': request['custom_id'], 'response': None,
+                               'error': {'code': type(e).__name__, 'message': str(e)}})
+        output_file_id = f'file-{uuid.uuid4().hex}'
+        self._files[output_file_id] = "".join(json.dumps(record) + "\n" for record in output)
+        batch = types.SimpleNamespace(id=f'batch-{uuid.uuid4().hex}', status='completed', endpoint=endpoint,
+                                      output_file_id=output_file_id, error_file_id=None, metadata=metadata)
+        self._batches[batch.id] = batch
+        return batch
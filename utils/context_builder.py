@@ -0,0 +1,126 @@
+# Standard library imports
+import os
+import re
+import threading
+
+# Third-party library imports
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Token budget for the data each stage embeds in its prompt, set with CONTEXT_BUDGET_<STAGE>.
+# Past the budget the least important rows are left out (see select_rows)
+CONTEXT_BUDGETS = {
+    stage: int(os.getenv(f'CONTEXT_BUDGET_{stage.upper()}', default))
+    for stage, default in [
+        ('drivers', 4000),           # the day's mood logs, for CHAIN 1
+        ('refine', 2500),            # the user's analysis history, for CHAIN 3
+        ('summary_logs', 4000),      # the period's mood logs, for the summary
+        ('summary_analysis', 1500),  # the period's analysis, for the summary
+    ]
+}
+
+# How fast a row's recency weight halves, in days, and the weight of an impact's strength
+RECENCY_HALF_LIFE = 14
+IMPACT_WEIGHTS = {'strong positive': 1.0, 'strong negative': 1.0, 'positive': 0.5, 'negative': 0.5}
+IMPACT_CODES = {'strong positive': '++', 'positive': '+', 'negative': '-', 'strong negative': '--'}
+
+# Roughly how the model's tokenizer splits text: a token per short word, number group or
+# punctuation mark, more for long words, and one per line break
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|\n|[^\w\s]")
+
+
+def count_tokens(text):
+    """Offline estimate of text's token count, close to (and usually above) the model tokenizer's."""
+    return sum(1 + len(piece) // 8 for piece in TOKEN_PATTERN.findall(text))
+
+
+## Rows left out per stage, for reporting how much context the budgets cut
+context_stats = {}
+context_stats_lock = threading.Lock()
+
+
+def record_cut(stage, rows, kept, tokens, cut_tokens):
+    with context_stats_lock:
+        stats = context_stats.setdefault(stage, {'rows': 0, 'kept': 0, 'tokens': 0, 'cut_tokens': 0})
+        stats['rows'] += rows
+        stats['kept'] += kept
+        stats['tokens'] += tokens
+        stats['cut_tokens'] += cut_tokens
+
+
+def cut_summary():
+    """Per stage, the share of context tokens left out by the budgets so far."""
+    with context_stats_lock:
+        return {stage: round(stats['cut_tokens'] / (stats['tokens'] + stats['cut_tokens']), 3)
+                for stage, stats in context_stats.items() if stats['tokens'] + stats['cut_tokens']}
+
+
+def select_rows(lines, priorities, stage, budget):
+    """Indices of the lines that fit the budget, taking the most important first, in their original order.
+
+    Records what was cut under stage.
+    """
+    costs = [count_tokens(line) + 1 for line in lines]
+    kept = []
+    for i in sorted(range(len(lines)), key=lambda i: priorities[i], reverse=True):
+        if costs[i] <= budget:
+            kept.append(i)
+            budget -= costs[i]
+    kept_tokens = sum(costs[i] for i in kept)
+    record_cut(stage, len(lines), len(kept), kept_tokens, sum(costs) - kept_tokens)
+    return sorted(kept)
+
+
+def left_out(total, kept):
+    return f"\n({total - len(kept)} older or lower-impact rows left out)" if len(kept) < total else ""
+
+
+def recency(dates):
+    """Weight of each date, halving every RECENCY_HALF_LIFE days before the latest."""
+    dates = pd.to_datetime(pd.Series(dates)).reset_index(drop=True)
+    age_days = (dates.max() - dates).dt.total_seconds() / 86400
+    return 0.5 ** (age_days / RECENCY_HALF_LIFE)
+
+
+def encode_analysis(df_md, stage):
+    """Mood analysis rows as compact lines under category headings, within the stage's token budget.
+
+    Past the budget, recent rows and strong impacts are kept first.
+    """
+    df_md = df_md.sort_values(['category', 'date'], kind='stable').reset_index(drop=True)
+    impacts = df_md['impact'].astype(str).str.strip().str.lower()
+    priorities = (recency(df_md['date']) + impacts.map(IMPACT_WEIGHTS).fillna(0)).tolist()
+    lines = [f"{pd.Timestamp(row.date):%Y-%m-%d} | {row.sub_category} | {IMPACT_CODES.get(impact, impact)} | {row.description}"
+             for row, impact in zip(df_md.itertuples(index=False), impacts)]
+
+    header = "date | sub-category | impact (++ strong positive, + positive, - negative, -- strong negative) | description"
+    headings = {category: f"[{category}]" for category in df_md['category'].unique()}
+    budget = CONTEXT_BUDGETS[stage] - count_tokens(header) - sum(count_tokens(heading) + 1 for heading in headings.values())
+    kept = select_rows(lines, priorities, stage, budget)
+
+    output, previous = [header], None
+    for i in kept:
+        if df_md['category'][i] != previous:
+            previous = df_md['category'][i]
+            output.append(headings[previous])
+        output.append(lines[i])
+    return "\n".join(output) + left_out(len(lines), kept)
+
+
+def encode_logs(logs, stage):
+    """Mood log rows (date, mood, description) as compact lines, within the stage's token budget.
+
+    Past the budget, recent entries and those furthest from the period's median mood are kept first.
+    """
+    logs = logs.reset_index(drop=True)
+    dates = pd.to_datetime(logs['date'])
+    deviation = (logs['mood'] - logs['mood'].median()).abs() / 5
+    priorities = (recency(dates) + deviation.fillna(0)).tolist()
+    lines = [f"{date:%Y-%m-%d %H:%M} | {mood:g} | {'' if pd.isna(description) else description}"
+             for date, mood, description in zip(dates, logs['mood'], logs['description'])]
+
+    header = "date | mood | description"
+    kept = select_rows(lines, priorities, stage, CONTEXT_BUDGETS[stage] - count_tokens(header))
+    return "\n".join([header] + [lines[i] for i in kept]) + left_out(len(lines), kept)
@@ -0,0 +1,85 @@
+# Standard library imports
+import hashlib
+import json
+import os
+import time
+
+# Third-party library imports
+import redis
+from cachelib import FileSystemCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cached responses expire after LLM_CACHE_TTL seconds; at most LLM_CACHE_MAX_ENTRIES are kept,
+# least recently used evicted first. Stored in Redis when REDISCLOUD_URL is set, else on disk
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 7 * 86400))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 5000))
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', '.llm_cache')
+
+
+def cache_key(**request):
+    """Content address of a request: a hash of everything that determines the response."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class RedisLRUCache:
+    """Response cache in Redis with a TTL per entry and a bound on the number of entries.
+
+    A sorted set tracks each entry's last use; past max_entries the least recently
+    used ones are evicted.
+    """
+
+    def __init__(self, client, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, prefix='llm_cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.index = f'{prefix}index'
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        self.client.zadd(self.index, {key: time.time()})
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        pipe.zadd(self.index, {key: now})
+        # Entries unused for a full TTL have expired on their own
+        pipe.zremrangebyscore(self.index, 0, now - self.ttl)
+        pipe.zcard(self.index)
+        size = pipe.execute()[-1]
+        if size > self.max_entries:
+            evicted = self.client.zpopmin(self.index, size - self.max_entries)
+            self.client.delete(*[self.prefix + (k.decode() if isinstance(k, bytes) else k) for k, _ in evicted])
+
+
+def _make_cache():
+    redis_url = os.getenv('REDISCLOUD_URL')
+    if redis_url:
+        return RedisLRUCache(redis.Redis.from_url(redis_url))
+    return FileSystemCache(LLM_CACHE_DIR, threshold=LLM_CACHE_MAX_ENTRIES, default_timeout=LLM_CACHE_TTL)
+
+
+response_cache = _make_cache()
+
+
+def get_cached_response(key):
+    """The cached response for key, or None. Cache errors are logged and read as a miss."""
+    try:
+        return response_cache.get(key)
+    except Exception as e:
+        print(f"LLM cache read failed: {e}")
+        return None
+
+
+def cache_response(key, value):
+    """Store a response; a failure to cache is logged and otherwise ignored."""
+    try:
+        response_cache.set(key, value)
+    except Exception as e:
+        print(f"LLM cache write failed: {e}")
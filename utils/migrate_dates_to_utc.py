@@ -0,0 +1,52 @@
+# Standard library imports
+import os
+import sys
+
+# Third-party library imports
+import pandas as pd
+from dotenv import load_dotenv
+from supabase import create_client, Client
+
+# Local imports
+from time_utils import LEGACY_DATE_FORMAT, localize_local_times
+from supabase_utils import stream_rows
+
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Your Supabase API URL and key
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
+SUPABASE_DB = os.getenv('SUPABASE_DB')
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY)
+
+
+def migrate_dates_to_utc(dry_run=False):
+    """One-off migration: rewrite legacy local-time mood entry dates as ISO-8601 UTC.
+
+    Rows already in ISO format are left alone, so the script is safe to re-run.
+    """
+    migrated = 0
+    for rows, _ in stream_rows(supabase, SUPABASE_DB, ['id', 'date', 'timezone'], []):
+        batch = pd.DataFrame(rows)
+
+        # Only rows still in the legacy '%m/%d/%Y %H:%M' local-time format need converting
+        local = pd.to_datetime(batch['date'], format=LEGACY_DATE_FORMAT, errors='coerce')
+        legacy = local.notna()
+        if not legacy.any():
+            continue
+
+        utc_dates = localize_local_times(local[legacy], batch.loc[legacy, 'timezone'])
+        for row_id, utc_date in zip(batch.loc[legacy, 'id'], utc_dates):
+            if not dry_run:
+                supabase.table(SUPABASE_DB).update({'date': utc_date.isoformat()}).eq('id', row_id).execute()
+            migrated += 1
+
+        print(f"{'Would migrate' if dry_run else 'Migrated'} {migrated} rows so far (through id {rows[-1]['id']})")
+
+    print(f"Done. {migrated} rows {'would be' if dry_run else 'were'} migrated to UTC.")
+
+
+if __name__ == "__main__":
+    migrate_dates_to_utc(dry_run='--dry-run' in sys.argv[1:])
@@ -1,17 +1,17 @@
 # Standard library imports
 import os
 import re
+import threading
 import pandas as pd
 import json
 from io import StringIO
 from datetime import datetime, timezone
 
 # Third-party library imports
-import pytz
-import requests
 from dotenv import load_dotenv
 import openai
 from langsmith import traceable
+from langsmith.utils import ContextThreadPoolExecutor
 from langsmith.wrappers import wrap_openai
 
 # Local module imports
@@ -21,6 +21,12 @@ from utils.supabase_utils import (
     delete_manalysis_rows_from_supabase,
     insert_manalysis_to_supabase
 )
+from utils.run_agreement import sample_until_agreement
+from utils.llm_cache import cache_key, get_cached_response, cache_response
+from utils.rate_limiter import estimate_tokens, wait_for_rate_limit, reconcile_usage
+from utils.resilience import ResilientCaller
+from utils.context_builder import encode_logs, encode_analysis
+from utils.analysis_index import relevant_history
 
 #Load environment variables from .env file
 load_dotenv()
@@ -28,271 +34,288 @@ load_dotenv()
 #Your OpenAI API key
 OPENAI_API_KEY =  os.getenv('OPENAI_API_KEY')
 
+#CHAIN 1 adaptive mode: start with CHAIN1_MIN_RUNS runs, then add CHAIN1_BATCH_SIZE at a time until
+#their agreement reaches CHAIN1_AGREEMENT (or the usual run cap). Set CHAIN1_ADAPTIVE=false to always run the cap
+CHAIN1_ADAPTIVE = os.getenv('CHAIN1_ADAPTIVE', 'true').lower() == 'true'
+CHAIN1_MIN_RUNS = int(os.getenv('CHAIN1_MIN_RUNS', 3))
+CHAIN1_BATCH_SIZE = int(os.getenv('CHAIN1_BATCH_SIZE', 2))
+CHAIN1_AGREEMENT = float(os.getenv('CHAIN1_AGREEMENT', 0.6))
+
+#Each prompt file is static instructions, then a %DATA% line, then the data section with its
+#%0%, %1%... placeholders. The instructions go out as the system message, identical for every
+#user, so the provider's prompt cache can serve them; only the data message varies
+def split_prompt(text):
+    instructions, data = text.split("%DATA%\n", 1)
+    return instructions.rstrip('\n'), data
+
+
+def prompt_messages(prompt, *values):
+    """The messages for a split prompt, with values filled into its data section in order."""
+    instructions, data = prompt
+    for i, value in enumerate(values):
+        data = data.replace(f"%{i}%", value)
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": data}
+    ]
+
+
 #Prompt Loading, for Daily Mood Analysis
 with open('utils/prompts/instruction_drivers.txt', 'r', encoding='utf-8') as file:
-    instruction_drivers = file.read()
+    instruction_drivers = split_prompt(file.read())
 # Load the instructions into the variable
 with open('utils/prompts/instruction_drivers_consolidate.txt', 'r', encoding='utf-8') as file:
-    instruction_drivers_consolidate = file.read()
+    instruction_drivers_consolidate = split_prompt(file.read())
 # Load the instructions into the variable
 with open('utils/prompts/instruction_drivers_refine.txt', 'r', encoding='utf-8') as file:
-    instruction_drivers_refine = file.read()
+    instruction_drivers_refine = split_prompt(file.read())
 
 #Prompt Loading, for Weekly Mood Trimming
 with open('utils/prompts/instruction_weeklytrim5_rt.txt', 'r', encoding='utf-8') as file:
-    instruction_weeklytrim5_rt = file.read()
+    instruction_weeklytrim5_rt = split_prompt(file.read())
 with open('utils/prompts/instruction_weeklytrim5_mibc.txt', 'r', encoding='utf-8') as file:
-    instruction_weeklytrim5_mibc = file.read()
+    instruction_weeklytrim5_mibc = split_prompt(file.read())
 with open('utils/prompts/instruction_weeklytrim5_se.txt', 'r', encoding='utf-8') as file:
-    instruction_weeklytrim5_se = file.read()
+    instruction_weeklytrim5_se = split_prompt(file.read())
 with open('utils/prompts/instruction_weeklytrim5_consolidate.txt', 'r', encoding='utf-8') as file:
-    instruction_weeklytrim5_consolidate = file.read()
+    instruction_weeklytrim5_consolidate = split_prompt(file.read())
 
 #Prompt Loading, for daily and weekly summaries
 with open('utils/prompts/instruction_daily.txt', 'r', encoding='utf-8') as file:
-    instruction_daily = file.read()
+    instruction_daily = split_prompt(file.read())
 with open('utils/prompts/instruction_weekly.txt', 'r', encoding='utf-8') as file:
-    instruction_weekly = file.read()
+    instruction_weekly = split_prompt(file.read())
+#Returned as-is, without calling the model, when there's nothing to summarize
+with open('utils/prompts/empty_daily.txt', 'r', encoding='utf-8') as file:
+    empty_daily = file.read()
+with open('utils/prompts/empty_weekly.txt', 'r', encoding='utf-8') as file:
+    empty_weekly = file.read()
 
 
-#The Wrapper to Monitor LLM Calls on LangSmith
-openai_client = wrap_openai(openai.Client(api_key=OPENAI_API_KEY))
+#The Wrapper to Monitor LLM Calls on LangSmith. Retries are left to resilient_call, not the SDK
+openai_client = wrap_openai(openai.Client(api_key=OPENAI_API_KEY, max_retries=0))
 
+#Deadlines, backoff, circuit breaking and (optionally) hedging for every model call
+resilient_call = ResilientCaller()
 
-@traceable
-def mood_analysis_pipeline(mood_data_csv,user_uuid):
-    ## Check if 'mood_data_csv' is empty
-    if pd.read_csv(StringIO(mood_data_csv)).empty:
-        print("No data in mood_data_csv. Skipping analysis.")
-        return  # End the function early if no data
 
-    ## CHAIN 1: Run Analysis X Times Based on Observations
-    ## Dynamically determine the number of runs: 3 * number of rows, capped at 10
-    num_runs = min(3 * mood_data_csv.strip().count('\n') , 10)
-    analysis_runs = ""
-    for i in range(num_runs):
-        messages = [
-            {"role": "user", "content": instruction_drivers.replace("%0%", mood_data_csv)}
-        ]
-        response = openai_client.chat.completions.create(
-            model='gpt-4o-mini',
-            messages=messages,
-            max_tokens=4095,
-            temperature=0.4,
-            top_p=1,
-            frequency_penalty=0,
-            presence_penalty=0.2
-        )
-        # Append each processed response
-        analysis_runs += response.choices[0].message.content + "\n"
+#The model and sampling settings every pipeline call uses
+CHAT_PARAMS = dict(
+    model='gpt-4o-mini',
+    max_tokens=4095,
+    temperature=0.4,
+    top_p=1,
+    frequency_penalty=0,
+    presence_penalty=0.2
+)
 
-    ## CHAIN 2: Consolidate Runs
-    consolidated_messages = [
-        {"role": "user", "content": instruction_drivers_consolidate.replace("%0%", analysis_runs)}
-    ]
 
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',
-        messages=consolidated_messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
+#Prompt tokens sent by this process's calls and how many the provider served from its prompt cache
+prompt_usage = {'calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+prompt_usage_lock = threading.Lock()
 
-    consolidated_content = response.choices[0].message.content
 
-    #Extracting historicals 
-    manalysis_historical = fetch_mood_analysis_historical(user_uuid, period='all')
-   
-    # Convert to CSV string
-    manalysis_historical = manalysis_historical.to_csv(index=False)
-    
-    ## CHAIN 3: Refine and Incorporate Into Results
-    refined_messages = [
-        {"role": "user", "content": instruction_drivers_refine
-            .replace("%0%", consolidated_content)
-            .replace("%1%", manalysis_historical)}
-    ]
+def record_prompt_usage(usage):
+    details = getattr(usage, 'prompt_tokens_details', None)
+    with prompt_usage_lock:
+        prompt_usage['calls'] += 1
+        prompt_usage['prompt_tokens'] += usage.prompt_tokens
+        prompt_usage['cached_tokens'] += getattr(details, 'cached_tokens', None) or 0
 
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',
-        messages=refined_messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
 
-    refined_content = response.choices[0].message.content
+def prompt_cache_hit_rate():
+    """Share of prompt tokens served from the provider's prompt cache so far (None before any call)."""
+    with prompt_usage_lock:
+        return prompt_usage['cached_tokens'] / prompt_usage['prompt_tokens'] if prompt_usage['prompt_tokens'] else None
+
+
+def chat_request(messages, n=1, draw=0):
+    """The response cache key and request body for a chat completion (see chat_completion)."""
+    return cache_key(messages=messages, n=n, draw=draw, **CHAT_PARAMS), dict(messages=messages, n=n, **CHAT_PARAMS)
 
-    ## RESULTS POST-PROCESSING
-    match = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", refined_content, re.DOTALL)
+
+def chat_completion(messages, n=1, draw=0, user=None):
+    """Run a chat completion with the pipeline's model and sampling settings, returning the n choices' contents.
+
+    Responses are cached under a hash of the model, parameters and rendered messages, so
+    rerunning on unchanged inputs doesn't call the model. draw numbers repeated samples
+    of the same prompt (this call returns samples draw..draw+n-1), so they stay distinct.
+    Calls wait their turn under the shared OpenAI rate limit, queued fairly by user, and
+    transient failures are retried within a deadline (utils/resilience.py).
+    """
+    key, request = chat_request(messages, n, draw)
+    contents = get_cached_response(key)
+    if contents is None:
+        estimate = estimate_tokens(messages, n)
+
+        def attempt(timeout):
+            response = openai_client.chat.completions.create(timeout=timeout, **request)
+            reconcile_usage(estimate, response.usage.total_tokens)
+            record_prompt_usage(response.usage)
+            return response
+
+        # Every attempt, retries included, waits for the shared rate limit before its timeout starts
+        response = resilient_call(attempt, before_attempt=lambda: wait_for_rate_limit(user, estimate))
+        contents = [choice.message.content for choice in response.choices]
+        cache_response(key, contents)
+    return contents
+
+
+def empty_category_result(category):
+    """What a weekly trimming category call returns when there are no rows for it, without calling the model."""
+    result = {"date": datetime.now(timezone.utc).strftime('%Y-%m-%d'), category: []}
+    return f"```json\n{json.dumps(result, indent=2)}\n```"
+
+
+def parse_json_result(content):
+    """The JSON object in a reply's ```json fence, or None if there isn't a valid one."""
+    match = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", content, re.DOTALL)
 
     if match:
         json_str = match.group(1).strip()
         try:
             # Parse the JSON string
-            parsed_json = json.loads(json_str)
-            return parsed_json
-            
+            return json.loads(json_str)
+
         except json.JSONDecodeError: pass
 
-@traceable
-def mood_summary(user_uuid, period):
-    # Fetch mood logs and analysis historical data
-    df = mood_data(period, user_uuid)
-    df_md = fetch_mood_analysis_historical(user_uuid, period=period)
 
+## Stage prompts, shared by the real-time pipeline and the batch runner (utils/batch_utils.py)
+def drivers_num_runs(mood_data_csv):
+    ## Dynamically determine the number of runs: 3 * number of rows, capped at 10
+    return min(3 * mood_data_csv.strip().count('\n') , 10)
+
+
+def drivers_messages(mood_data_csv):
+    return prompt_messages(instruction_drivers, encode_logs(pd.read_csv(StringIO(mood_data_csv)), 'drivers'))
+
+
+def consolidate_messages(runs):
+    analysis_runs = "".join(content + "\n" for content in runs)
+    return prompt_messages(instruction_drivers_consolidate, analysis_runs)
+
+
+def refine_messages(consolidated_content, manalysis_historical, user_uuid):
+    """The refine prompt for a consolidated analysis and the user's analysis history (DataFrame).
+
+    Only the historicals most similar to the day's drivers are sent (utils/analysis_index.py).
+    """
+    manalysis_historical = relevant_history(user_uuid, manalysis_historical, consolidated_content)
+    historical = "no records" if manalysis_historical.empty else encode_analysis(manalysis_historical, 'refine')
+    return prompt_messages(instruction_drivers_refine, consolidated_content, historical)
+
+
+def summary_messages(df, df_md, period):
+    """The summary prompt for a period's logs (CSV) and analysis (DataFrame); None when both are empty."""
     # Determine instruction based on the period
     instruction = instruction_daily if period == 'daily' else instruction_weekly
 
-    # Check if 'df' is empty, and set appropriate content
-    df_content = "no records" if pd.read_csv(StringIO(df)).empty else df
+    # Check if 'df' is empty, and set appropriate content (compact and within the stage budgets)
+    logs = pd.read_csv(StringIO(df))
+    df_empty = logs.empty
+    df_content = "no records" if df_empty else encode_logs(logs, 'summary_logs')
 
     # Check if 'df_md' is empty, and set appropriate content
-    df_md_content = "no records" if df_md.empty else df_md.to_csv(index=False)
-
-    # Replace placeholders in the instruction
-    messages = [
-        {
-            "role": "user",
-            "content": instruction
-            .replace("%0%", df_content)
-            .replace("%1%", df_md_content)
-        }
-    ]
+    df_md_content = "no records" if df_md.empty else encode_analysis(df_md, 'summary_analysis')
+
+    # Nothing to summarize: the caller uses the empty template instead of the model
+    if df_empty and df_md.empty:
+        return None
+
+    # Replace placeholders in the instruction's data section
+    return prompt_messages(instruction, df_content, df_md_content)
+
+
+def empty_summary(period):
+    return empty_daily if period == 'daily' else empty_weekly
+
+
+@traceable
+def mood_analysis_pipeline(mood_data_csv,user_uuid):
+    ## Check if 'mood_data_csv' is empty
+    if pd.read_csv(StringIO(mood_data_csv)).empty:
+        print("No data in mood_data_csv. Skipping analysis.")
+        return  # End the function early if no data
+
+    ## CHAIN 1: Run Analysis X Times Based on Observations
+    ## The runs share one prompt, so they're sampled as n completions of a single request
+    num_runs = drivers_num_runs(mood_data_csv)
+    messages = drivers_messages(mood_data_csv)
+    if CHAIN1_ADAPTIVE:
+        ## Stop sampling once the runs agree on the drivers; quiet days rarely need the full cap
+        runs = sample_until_agreement(lambda n, drawn: chat_completion(messages, n=n, draw=drawn, user=user_uuid), num_runs,
+                                      CHAIN1_MIN_RUNS, CHAIN1_BATCH_SIZE, CHAIN1_AGREEMENT)
+    else:
+        runs = chat_completion(messages, n=num_runs, user=user_uuid)
+
+    ## CHAIN 2: Consolidate Runs
+    # Call the OpenAI API
+    consolidated_content = chat_completion(consolidate_messages(runs), user=user_uuid)[0]
+
+    #Extracting historicals 
+    manalysis_historical = fetch_mood_analysis_historical(user_uuid, period='all')
+    
+    ## CHAIN 3: Refine and Incorporate Into Results
+    # Call the OpenAI API
+    refined_content = chat_completion(refine_messages(consolidated_content, manalysis_historical, user_uuid), user=user_uuid)[0]
+
+    ## RESULTS POST-PROCESSING
+    return parse_json_result(refined_content)
+
+@traceable
+def mood_summary(user_uuid, period, now=None):
+    # Fetch mood logs and analysis historical data for the same day/week (now is the run's time)
+    df = mood_data(period, user_uuid, now=now)
+    df_md = fetch_mood_analysis_historical(user_uuid, period=period, now=now)
+
+    messages = summary_messages(df, df_md, period)
+
+    # Nothing to summarize: skip the model
+    if messages is None:
+        return empty_summary(period)
 
     # Call the OpenAI API
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',  # Or whichever model you're using
-        messages=messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
-
-    processed_content = response.choices[0].message.content
+    processed_content = chat_completion(messages, user=user_uuid)[0]
 
     return processed_content
 
 
 @traceable
-def weekly_manalysis_trimming(user_uuid):
+def weekly_manalysis_trimming(user_uuid, now=None):
     #This funciton is designed to be run on Monday Mornings.. Covering all prior analysis information from last monday - sunday 
     
-    #Pull the weekly historical data
-    df_md = fetch_mood_analysis_historical(user_uuid,'weekly')
+    #Pull the weekly historical data (the week before now, the run's time)
+    df_md = fetch_mood_analysis_historical(user_uuid,'weekly', now=now)
 
     # Check if 'df_md' is empty, and skip processing if so
     if df_md.empty:
         print("No data in weekly historical mood analysis. Skipping trimming.")
         return  # End the function early if no data
         
-    messages = [
-        {
-            "role": "user",
-            "content": instruction_weeklytrim5_rt
-            .replace("%0%",                      
-                     ("no records found" 
-                      if df_md[df_md.category == "recurring_triggers"].empty 
-                      else df_md[df_md.category == "recurring_triggers"].to_csv(index=False)
-                    )
-                    )
-        }
-    ]
-    
-    # Call the OpenAI API
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',  # Or whichever model you're using
-        messages=messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
-    
-    processed_content_rt = response.choices[0].message.content
-
-    messages = [
-        {
-            "role": "user",
-            "content": instruction_weeklytrim5_mibc
-            .replace("%0%",                      
-                     ("no records found" 
-                      if df_md[df_md.category == "mood_impact_by_category"].empty 
-                      else df_md[df_md.category == "mood_impact_by_category"].to_csv(index=False)
-                    )
-                    )        }
-    ]
-    
-    # Call the OpenAI API
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',  # Or whichever model you're using
-        messages=messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
-    
-    processed_content_mibc = response.choices[0].message.content
-
-    messages = [
-        {
-            "role": "user",
-            "content": instruction_weeklytrim5_se
-            .replace("%0%",
-                     ("no records found" 
-                      if df_md[df_md.category == "significant_events"].empty 
-                      else df_md[df_md.category == "significant_events"].to_csv(index=False)
-                    )
-                    )        
-        }
+    # One prompt per category; the three calls are independent, so they run concurrently.
+    # A category with no rows gets an empty result without calling the model
+    def trim_category(instruction, category):
+        rows = df_md[df_md.category == category]
+        if rows.empty:
+            return empty_category_result(category)
+        return chat_completion(prompt_messages(instruction, rows.to_csv(index=False)), user=user_uuid)[0]
+
+    categories = [
+        (instruction_weeklytrim5_rt, "recurring_triggers"),
+        (instruction_weeklytrim5_mibc, "mood_impact_by_category"),
+        (instruction_weeklytrim5_se, "significant_events")
     ]
-    
-    # Call the OpenAI API
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',  # Or whichever model you're using
-        messages=messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
-    
-    processed_content_se = response.choices[0].message.content
 
+    # Call the OpenAI API (the executor carries the LangSmith trace context into its threads)
+    with ContextThreadPoolExecutor(max_workers=len(categories)) as executor:
+        processed_content_rt, processed_content_mibc, processed_content_se = executor.map(
+            lambda args: trim_category(*args), categories
+        )
 
-    messages = [
-        {
-            "role": "user",
-            "content": instruction_weeklytrim5_consolidate
-            .replace("%0%", processed_content_rt)
-            .replace("%1%",processed_content_mibc)
-            .replace("%2%",processed_content_se)
-        }
-    ]
+    messages = prompt_messages(instruction_weeklytrim5_consolidate, processed_content_rt, processed_content_mibc, processed_content_se)
     
     # Call the OpenAI API
-    response = openai_client.chat.completions.create(
-        model='gpt-4o-mini',  # Or whichever model you're using
-        messages=messages,
-        max_tokens=4095,
-        temperature=0.4,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0.2
-    )
-    
-    processed_content_consolidate = response.choices[0].message.content
+    processed_content_consolidate = chat_completion(messages, user=user_uuid)[0]
 
     ##Deleting the input rows. Will switch out for consolidated rows 
     delete_manalysis_rows_from_supabase(user_uuid, ids_to_delete = df_md['id'].tolist(), trim=False)
@@ -0,0 +1,157 @@
+# Standard library imports
+import os
+import time
+import uuid
+
+# Third-party library imports
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The account's OpenAI limits for the pipeline's model. Calls are held to RATE_LIMIT_HEADROOM of
+# them, and at most RATE_LIMIT_BURST_SECONDS worth of budget is spent at once, so throughput
+# stays level instead of bursting into 429s. Shared through Redis (REDISCLOUD_URL) by every
+# process and dyno; without Redis, calls aren't limited
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', 500))
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', 200000))
+RATE_LIMIT_HEADROOM = float(os.getenv('RATE_LIMIT_HEADROOM', 0.9))
+RATE_LIMIT_BURST_SECONDS = float(os.getenv('RATE_LIMIT_BURST_SECONDS', 6))
+
+# Expected completion length, for estimating a call's tokens before it's made
+EXPECTED_COMPLETION_TOKENS = int(os.getenv('EXPECTED_COMPLETION_TOKENS', 800))
+
+# How often a caller that isn't at the front of the queue checks again, and how long a queued
+# caller can go without checking before it's assumed gone and dropped from the queue
+QUEUE_POLL_INTERVAL = 0.05
+QUEUE_STALE_AFTER = 10
+
+# Takes one request and `cost` tokens from the buckets if the ticket is at the front of the
+# queue and both have enough. Returns 0 when taken, -1 when not at the front, else the
+# milliseconds until the buckets will have refilled enough. Uses the Redis clock, so all
+# callers agree on the time
+ACQUIRE_SCRIPT = """
+local bucket, queue, seen, served = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local ticket, user = ARGV[1], ARGV[2]
+local request_rate, request_capacity = tonumber(ARGV[3]), tonumber(ARGV[4])
+local token_rate, token_capacity = tonumber(ARGV[5]), tonumber(ARGV[6])
+local cost, stale_after = tonumber(ARGV[7]), tonumber(ARGV[8])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+-- Queued by how many calls the user has had, so one busy user can't starve the others
+if not redis.call('ZSCORE', queue, ticket) then
+    redis.call('ZADD', queue, tonumber(redis.call('HGET', served, user) or 0), ticket)
+end
+redis.call('HSET', seen, ticket, now)
+while true do
+    local head = redis.call('ZRANGE', queue, 0, 0)[1]
+    if head == nil or now - tonumber(redis.call('HGET', seen, head) or 0) <= stale_after then
+        break
+    end
+    redis.call('ZREM', queue, head)
+    redis.call('HDEL', seen, head)
+end
+if redis.call('ZRANGE', queue, 0, 0)[1] ~= ticket then
+    return -1
+end
+
+local state = redis.call('HMGET', bucket, 'requests', 'tokens', 'updated_at')
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local requests = math.min(request_capacity, (tonumber(state[1]) or request_capacity) + elapsed * request_rate)
+local tokens = math.min(token_capacity, (tonumber(state[2]) or token_capacity) + elapsed * token_rate)
+-- A call bigger than the bucket waits for a full bucket and leaves it in debt
+local needed = math.min(cost, token_capacity)
+local wait = math.max((1 - requests) / request_rate, (needed - tokens) / token_rate)
+if wait <= 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+    redis.call('ZREM', queue, ticket)
+    redis.call('HDEL', seen, ticket)
+    redis.call('HINCRBY', served, user, 1)
+    redis.call('EXPIRE', served, 3600)
+end
+redis.call('HSET', bucket, 'requests', tostring(requests), 'tokens', tostring(tokens), 'updated_at', tostring(now))
+if wait <= 0 then
+    return 0
+end
+return math.max(1, math.ceil(wait * 1000))
+"""
+
+# Corrects the token bucket by the difference between a call's estimate and its actual usage
+RECONCILE_SCRIPT = """
+local capacity, delta = tonumber(ARGV[1]), tonumber(ARGV[2])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or capacity)
+redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(capacity, tokens + delta)))
+"""
+
+
+def estimate_tokens(messages, n=1):
+    """Rough token count of a chat call before it's made: ~4 characters per prompt token, plus n expected completions."""
+    return sum(len(message['content']) for message in messages) // 4 + n * EXPECTED_COMPLETION_TOKENS
+
+
+class RateLimiter:
+    """Token buckets in Redis for requests and tokens per minute, shared by every caller.
+
+    Callers wait in one queue, ordered by how many calls each user has had, and take
+    from the buckets in turn. A call's tokens are estimated up front and corrected with
+    its actual usage afterwards (reconcile).
+    """
+
+    def __init__(self, client, rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT, headroom=RATE_LIMIT_HEADROOM,
+                 burst_seconds=RATE_LIMIT_BURST_SECONDS, prefix='openai_rate_limit:'):
+        self.client = client
+        self.request_rate = rpm * headroom / 60
+        self.token_rate = tpm * headroom / 60
+        self.request_capacity = max(1.0, self.request_rate * burst_seconds)
+        self.token_capacity = self.token_rate * burst_seconds
+        self.keys = [f'{prefix}{name}' for name in ('bucket', 'queue', 'seen', 'served')]
+        self._acquire = client.register_script(ACQUIRE_SCRIPT)
+        self._reconcile = client.register_script(RECONCILE_SCRIPT)
+
+    def acquire(self, user, tokens):
+        """Block until a call of about `tokens` tokens may be made for user."""
+        ticket = f'{time.time_ns():020d}:{uuid.uuid4().hex}'
+        while True:
+            wait = self._acquire(keys=self.keys, args=[
+                ticket, user or '', self.request_rate, self.request_capacity,
+                self.token_rate, self.token_capacity, tokens, QUEUE_STALE_AFTER
+            ])
+            if wait == 0:
+                return
+            # Not at the front yet, or waiting for a refill; recheck before the queue would drop the ticket
+            time.sleep(QUEUE_POLL_INTERVAL if wait < 0 else min(wait / 1000, QUEUE_STALE_AFTER / 2))
+
+    def reconcile(self, estimate, actual):
+        self._reconcile(keys=self.keys[:1], args=[self.token_capacity, estimate - actual])
+
+
+def _make_limiter():
+    redis_url = os.getenv('REDISCLOUD_URL')
+    if redis_url:
+        return RateLimiter(redis.Redis.from_url(redis_url))
+    return None
+
+
+rate_limiter = _make_limiter()
+
+
+def wait_for_rate_limit(user, tokens):
+    """Wait for the shared rate limit. Limiter errors are logged and let the call through."""
+    if rate_limiter is None:
+        return
+    try:
+        rate_limiter.acquire(user, tokens)
+    except redis.RedisError as e:
+        print(f"Rate limiter unavailable: {e}")
+
+
+def reconcile_usage(estimate, actual):
+    """Correct the shared token budget with a call's actual usage; failures are logged and otherwise ignored."""
+    if rate_limiter is None:
+        return
+    try:
+        rate_limiter.reconcile(estimate, actual)
+    except redis.RedisError as e:
+        print(f"Rate limiter unavailable: {e}")
@@ -0,0 +1,205 @@
+# Standard library imports
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Third-party library imports
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Each attempt gets up to OPENAI_ATTEMPT_TIMEOUT seconds, and a call (all its attempts and
+# backoff) up to OPENAI_CALL_DEADLINE. Retries back off exponentially from OPENAI_BACKOFF_BASE
+# up to OPENAI_BACKOFF_MAX seconds, with full jitter
+OPENAI_ATTEMPT_TIMEOUT = float(os.getenv('OPENAI_ATTEMPT_TIMEOUT', 90))
+OPENAI_CALL_DEADLINE = float(os.getenv('OPENAI_CALL_DEADLINE', 300))
+OPENAI_MAX_ATTEMPTS = int(os.getenv('OPENAI_MAX_ATTEMPTS', 5))
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', 1))
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', 30))
+# An attempt left with less than this before the deadline isn't started
+MIN_ATTEMPT_TIMEOUT = 1.0
+
+# After CIRCUIT_FAILURE_THRESHOLD retryable failures in a row (rate limits aside), calls fail fast for
+# CIRCUIT_RESET_AFTER seconds, then a single trial call decides whether to close again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 8))
+CIRCUIT_RESET_AFTER = float(os.getenv('CIRCUIT_RESET_AFTER', 60))
+
+# Hedging (off by default, since a hedge is billed too): an attempt still running past the
+# HEDGE_PERCENTILE of recent latencies gets a duplicate, and the first to finish wins
+OPENAI_HEDGE = os.getenv('OPENAI_HEDGE', 'false').lower() == 'true'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.95))
+HEDGE_MIN_SAMPLES = 20
+
+# Rate limits, server errors, timeouts and dropped connections are worth retrying; bad
+# requests and auth errors aren't
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APITimeoutError, openai.APIConnectionError)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling while the circuit breaker is open."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when the call's deadline passes before an attempt can be made (e.g. while waiting for the rate limiter)."""
+
+
+class CircuitBreaker:
+    """Fails calls fast after repeated failures, so an outage doesn't tie up every user's chain in retries."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_after=CIRCUIT_RESET_AFTER):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_after or self.trial_running:
+                raise CircuitOpenError("OpenAI calls are failing; not calling until the circuit resets")
+            # Half-open: let one trial call through
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        """Give up a half-open trial that was never made, so the next call can take it."""
+        with self.lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class LatencyTracker:
+    """Recent successful attempt latencies, for the hedging threshold."""
+
+    def __init__(self, size=200):
+        self.latencies = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def percentile(self, q):
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def backoff_delay(attempt, error=None):
+    """Seconds to wait before retry number `attempt` (1-based), honouring a 429's Retry-After."""
+    retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('retry-after')
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+class ResilientCaller:
+    """Runs a call with per-attempt timeouts, jittered exponential backoff, a circuit breaker and optional hedging.
+
+    call(timeout) makes one attempt and must give up after timeout seconds. before_attempt(),
+    if given, runs ahead of each attempt (e.g. to wait for the rate limiter), outside its
+    timeout, its latency measurement and its hedge.
+    """
+
+    def __init__(self, hedge=OPENAI_HEDGE, max_attempts=OPENAI_MAX_ATTEMPTS, attempt_timeout=OPENAI_ATTEMPT_TIMEOUT,
+                 deadline=OPENAI_CALL_DEADLINE, breaker=None, hedge_workers=8):
+        self.hedge = hedge
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers) if hedge else None
+
+    def __call__(self, call, before_attempt=None):
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(1, self.max_attempts + 1):
+            self.breaker.before_call()
+            if before_attempt is not None:
+                before_attempt()
+            timeout = min(self.attempt_timeout, deadline - time.monotonic())
+            if timeout < MIN_ATTEMPT_TIMEOUT:
+                # The time went on waiting, not on the service, so it says nothing about its health
+                self.breaker.release_trial()
+                raise DeadlineExceededError(f"OpenAI call deadline passed before attempt {attempt} could be made")
+            try:
+                result = self._attempt(call, timeout)
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    # A 429 means the service is up but we're over the limit: back off, don't open the circuit
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                delay = backoff_delay(attempt, e)
+                if attempt == self.max_attempts or time.monotonic() + delay >= deadline:
+                    raise
+                print(f"OpenAI call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # The service answered (e.g. a bad request), so it isn't down
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def _attempt(self, call, timeout):
+        started = time.monotonic()
+        hedge_after = self.latency.percentile(HEDGE_PERCENTILE) if self.hedge else None
+        if hedge_after is None or hedge_after >= timeout:
+            result = call(timeout)
+        else:
+            result = self._hedged(call, timeout, hedge_after)
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    def _hedged(self, call, timeout, hedge_after):
+        # Attempts run with the caller's context (e.g. the LangSmith trace). The primary starts
+        # at once on a thread of its own, so a busy hedge pool never delays it or skews the
+        # latencies; only hedges go through the pool
+        primary = Future()
+        context = contextvars.copy_context()
+        def run_primary():
+            try:
+                primary.set_result(context.run(call, timeout))
+            except BaseException as e:
+                primary.set_exception(e)
+        threading.Thread(target=run_primary, daemon=True).start()
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        # The slower attempt is left to finish in the background; its result is discarded. The
+        # hedge doesn't wait for the rate limiter: it's rare by design, and reconciled like any call
+        hedge = self.hedge_pool.submit(contextvars.copy_context().run, call, timeout - hedge_after)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:
+                raise next(iter(done)).exception()
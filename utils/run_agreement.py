@@ -0,0 +1,80 @@
+# Standard library imports
+import itertools
+import json
+import re
+
+# The categories a CHAIN 1 run reports on (see prompts/instruction_drivers.txt)
+CATEGORIES = ('recurring_triggers', 'mood_impact_by_category', 'significant_events')
+
+# Words too generic to tell two drivers apart
+STOPWORDS = {'and', 'the', 'for', 'with', 'from', 'into', 'during', 'after', 'before', 'about', 'day', 'time', 'user'}
+
+
+def parse_run(content):
+    """Parse one run's JSON reflection, from a ```json fence or the bare reply. None if it isn't valid JSON."""
+    match = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", content or "")
+    try:
+        return json.loads(match.group(1) if match else content)
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+
+def run_signature(run):
+    """The drivers a parsed run reports, as (category, impact direction, keywords) tuples; None if it didn't parse.
+
+    Sub-categories are free text, so they're reduced to keywords; impacts only to a
+    direction, since runs often disagree on "strong" without disagreeing on the driver.
+    """
+    if not isinstance(run, dict):
+        return None
+    drivers = []
+    for category in CATEGORIES:
+        for item in run.get(category) or []:
+            if not isinstance(item, dict):
+                continue
+            direction = 'negative' if 'negative' in str(item.get('impact', '')).lower() else 'positive'
+            keywords = frozenset(word for word in re.findall(r"[a-z]+", str(item.get('sub_category', '')).lower())
+                                 if len(word) > 2 and word not in STOPWORDS)
+            drivers.append((category, direction, keywords))
+    return drivers
+
+
+def similarity(a, b):
+    """F1 of the drivers two runs share; a run that didn't parse agrees with nothing.
+
+    Two drivers match when they have the same category and direction and share a
+    keyword ("Morning Workout" and "Exercise in the Morning"). Each matches at most once.
+    """
+    if a is None or b is None:
+        return 0.0
+    if not a and not b:
+        return 1.0
+    unmatched = list(b)
+    matches = 0
+    for category, direction, keywords in a:
+        for i, (other_category, other_direction, other_keywords) in enumerate(unmatched):
+            if category == other_category and direction == other_direction and keywords & other_keywords:
+                matches += 1
+                del unmatched[i]
+                break
+    return 2 * matches / (len(a) + len(b))
+
+
+def agreement(contents):
+    """Mean pairwise similarity between runs (1.0 for fewer than two)."""
+    signatures = [run_signature(parse_run(content)) for content in contents]
+    pairs = list(itertools.combinations(signatures, 2))
+    return sum(similarity(a, b) for a, b in pairs) / len(pairs) if pairs else 1.0
+
+
+def sample_until_agreement(sample, max_runs, min_runs=3, batch_size=2, threshold=0.6):
+    """Draw runs in batches until they agree, instead of always drawing max_runs.
+
+    sample(n, drawn) returns n new run contents, given how many were drawn before. Starts
+    with min_runs, then adds batch_size runs at a time until the mean pairwise agreement
+    reaches threshold or max_runs is hit.
+    """
+    contents = list(sample(min(min_runs, max_runs), 0))
+    while len(contents) < max_runs and agreement(contents) < threshold:
+        contents += sample(min(batch_size, max_runs - len(contents)), len(contents))
+    return contents
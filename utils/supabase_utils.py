@@ -1,17 +1,20 @@
 # Standard library imports
 import os
-import re
 import json
 from datetime import datetime, timezone
 
 # Third-party library imports
+import numpy as np
 import pandas as pd
-import pytz
 import requests
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from langsmith import traceable
 
+# Local module imports
+from utils.time_utils import to_timezone, parse_utc_dates, local_times
+from utils.analysis_index import index_rows, unindex_rows
+
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,6 +25,72 @@ SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
 SUPABASE_DB = os.getenv('SUPABASE_DB')
 SUPABASE_DB_MANALYSIS = os.getenv('SUPABASE_DB_MANALYSIS')
 
+# Rows per page when streaming a table, kept at PostgREST's default max-rows cap
+PAGE_SIZE = 1000
+
+#Function to stream a table's rows with keyset pagination
+def stream_rows(supabase, table, columns, filters, after_id=None, page_size=PAGE_SIZE):
+    """Yield (rows, total) batches of a table in id order, paging with id > last_id.
+
+    filters is a list of (operator, column, value) tuples applied to every page,
+    e.g. [('eq', 'user_uuid', user_uuid)]. Only the first page asks PostgREST for
+    the exact row count, so total is None on every later batch.
+    """
+    last_id = after_id
+    total = None
+    seen = 0
+    count = 'exact'
+    while True:
+        query = supabase.table(table).select(', '.join(columns), count=count)
+        for operator, column, value in filters:
+            query = getattr(query, operator)(column, value)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        response = query.order('id').limit(page_size).execute()
+
+        rows = response.data
+        if count:
+            total = response.count
+        if not rows:
+            break
+        yield rows, (total if count else None)
+
+        seen += len(rows)
+        # A short page only means we're done once we've seen every counted row; the server
+        # may cap pages below page_size
+        if len(rows) < page_size and total is not None and seen >= total:
+            break
+        last_id = rows[-1]['id']
+        count = None
+
+
+#Function to load a table into a DataFrame through preallocated column buffers
+def load_frame(supabase, table, columns, filters, dtypes=None, after_id=None, page_size=PAGE_SIZE):
+    """Stream a table with stream_rows and append each batch into preallocated column buffers.
+
+    The buffers are sized from the row count returned with the first page, so only
+    one page of JSON is held at a time on top of the columns themselves.
+    """
+    dtypes = dtypes or {}
+    buffers = None
+    filled = 0
+    for rows, total in stream_rows(supabase, table, columns, filters, after_id=after_id, page_size=page_size):
+        if buffers is None:
+            capacity = max(total or 0, len(rows))
+            buffers = {column: np.empty(capacity, dtype=dtypes.get(column, object)) for column in columns}
+        if filled + len(rows) > capacity:
+            # Rows were inserted after the count was taken
+            capacity = max(2 * capacity, filled + len(rows))
+            buffers = {column: np.resize(buffer, capacity) for column, buffer in buffers.items()}
+        for column in columns:
+            buffers[column][filled:filled + len(rows)] = [row[column] for row in rows]
+        filled += len(rows)
+
+    if buffers is None:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame({column: buffer[:filled] for column, buffer in buffers.items()})
+
+
 #Function to insert data into Supabase mood logs table
 @traceable
 def insert_data_to_supabase(data):
@@ -30,20 +99,12 @@ def insert_data_to_supabase(data):
     headers = {
         "apikey": SUPABASE_API_KEY,
         "Authorization": f"Bearer {SUPABASE_API_KEY}",
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Prefer": "return=representation"  # Echo the inserted row back so callers can update their caches
     }
 
-    # Use the user's timezone to get the current time
-    user_timezone = data.get('timezone')
-    try:
-        user_tz = pytz.timezone(user_timezone)
-        current_time = datetime.now(timezone.utc).astimezone(user_tz).strftime('%m/%d/%Y %H:%M')
-    except Exception as e:
-        # Log the error for debugging
-        print(f"An error occurred: {e}")
-        # Fallback to just set timezone as UTC 
-        user_tz = pytz.timezone('UTC')
-        current_time = datetime.now(timezone.utc).astimezone(user_tz).strftime('%m/%d/%Y %H:%M')
+    # Store the entry time canonically as ISO-8601 UTC; the timezone column keeps the user's zone for local bucketing
+    current_time = datetime.now(timezone.utc).isoformat(timespec='seconds')
 
     # Prepare data for insertion
     data_to_insert = {
@@ -59,7 +120,9 @@ def insert_data_to_supabase(data):
 
     if response.status_code == 201:
         print("Data inserted successfully!")
-        return True
+        # Return the inserted row (falls back to what we sent if the body is empty)
+        inserted = response.json() if response.text else None
+        return inserted[0] if inserted else data_to_insert
     else:
         print(f"Failed to insert data: {response.status_code}, {response.text}")
         return False
@@ -73,9 +136,12 @@ def insert_manalysis_to_supabase(data, user_uuid):
     headers = {
         "apikey": SUPABASE_API_KEY,
         "Authorization": f"Bearer {SUPABASE_API_KEY}",
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Prefer": "return=representation"  # Echo the inserted rows back, with their ids, for the retrieval index
     }
     
+    inserted = []
+
     for category, records in data.items():
         record_date = data["date"]
         if category == "date": continue  # Skip the date field
@@ -94,80 +160,103 @@ def insert_manalysis_to_supabase(data, user_uuid):
                 response = requests.post(url, headers=headers, data=json.dumps(data_to_insert))
                 if response.status_code == 201:
                     print(f"Inserted: {data_to_insert}")
+                    inserted += response.json() if response.text else []
                 else:
                     print(f"Failed to insert: {response.status_code}, {response.text}")
             except KeyError as  e:
                 print(f"Missing key {e} in record: {record}. Skipping.")
 
+    # Keep the user's retrieval index in step with the table
+    if inserted:
+        index_rows(user_uuid, inserted)
 
 
-#Function to extract mood entries from database
-@traceable
-def mood_data(period, user_uuid):
-    # Initialize the Supabase client
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY)
-    
-    # Fetch data from the "mood_entries" table for the specific user
-    response = supabase.table(SUPABASE_DB).select('id, date, mood, description').eq('user_uuid', user_uuid).execute()
-    
-    # Extract the data
-    data = response.data
-    
-    # Convert the data to a pandas DataFrame
-    df = pd.DataFrame(data)
-    
-    # Turn the date column to the pandas Timestamp 
-    df['date'] = pd.to_datetime(df['date'])
 
-    # Convert the current date to a pandas Timestamp
-    current_date = pd.to_datetime(datetime.today().date())
-    
+#Function to turn a reporting period into a date window
+def period_window(period, now=None):
+    """Return the [start, end) timestamps of the last full day ('daily') or Monday-Sunday week ('weekly')."""
+    current_date = pd.Timestamp(now if now is not None else datetime.today()).normalize()
+
     if period == 'weekly':
         # Find the most recent Monday before or on the current date
         last_monday = current_date - pd.Timedelta(days=current_date.weekday())
-        
-        # Find the start of the last full week (7 days before last_monday)
-        start_of_last_full_week = last_monday - pd.Timedelta(weeks=1)
-        
-        # End of the last full week at 23:59:59
-        end_of_last_full_week = (start_of_last_full_week + pd.Timedelta(days=6)).replace(hour=23, minute=59, second=59)
-        
-        # Filter the dataframe to get the dates within the last full week
-        mood_data = df[(df['date'] >= pd.to_datetime(start_of_last_full_week)) & (df['date'] <= pd.to_datetime(end_of_last_full_week))].iloc[:,1:]
+
+        # The last full week runs from the Monday before that up to (not including) last_monday
+        return last_monday - pd.Timedelta(weeks=1), last_monday
 
     elif period == 'daily':
-        # Find the most recent full day (yesterday)
-        start_of_last_day = current_date - pd.Timedelta(days=1)
-        
-        # End of the last day at 23:59:59
-        end_of_last_day = start_of_last_day.replace(hour=23, minute=59, second=59)
-        
-        # Filter the dataframe to get the dates within the last full day
-        mood_data = df[(df['date'] >= pd.to_datetime(start_of_last_day)) & (df['date'] <= pd.to_datetime(end_of_last_day))].iloc[:,1:]
-
-    # Convert the DataFrame to a CSV string
-    csv_string = mood_data.to_csv(index=False)
+        # The most recent full day (yesterday)
+        return current_date - pd.Timedelta(days=1), current_date
+
+    raise ValueError(f"Invalid period: {period}. Please use 'daily' or 'weekly'.")
+
+
+#Function to name the period a summary covers
+def period_start_date(period, now=None):
+    """The first day ('YYYY-MM-DD') of the period period_window gives for now, as used in summary file names."""
+    return period_window(period, now)[0].strftime('%Y-%m-%d')
+
+
+#Function to build the server-side filters for a user's rows in a period
+def window_filters(user_uuid, period, now=None, user_timezone=None):
+    """PostgREST filters selecting a user's rows whose date falls in the period's window.
+
+    The window's days come from now, a naive run time (the server's clock by default),
+    so every user's run covers the same dates. With user_timezone those dates are taken
+    as the user's local days and converted to the UTC bounds mood entries are stored in.
+    Without it the bounds are plain dates, which suits the mood analysis table.
+    """
+    filters = [('eq', 'user_uuid', user_uuid)]
+    if period in ('daily', 'weekly'):
+        start, end = period_window(period, now)
+        if user_timezone:
+            tz = to_timezone(user_timezone)
+            bounds = (bound.tz_localize(tz, ambiguous=False, nonexistent='shift_forward').tz_convert('UTC').isoformat()
+                      for bound in (start, end))
+        else:
+            bounds = start.date().isoformat(), end.date().isoformat()
+        filters += list(zip(('gte', 'lt'), ('date', 'date'), bounds))
+    return filters
+
+
+#Function to look up the timezone of a user's latest mood entry
+def latest_timezone(supabase, user_uuid):
+    response = supabase.table(SUPABASE_DB).select('id, timezone').eq('user_uuid', user_uuid).order('id', desc=True).limit(1).execute()
+    return response.data[0]['timezone'] if response.data else 'UTC'
+
+
+#Function to extract mood entries from database
+@traceable
+def mood_data(period, user_uuid, supabase=None, now=None, user_timezone=None):
+    # Initialize the Supabase client (pass one in to query a local stand-in instead)
+    supabase = supabase or create_client(SUPABASE_URL, SUPABASE_API_KEY)
+
+    # The run's day/week, bounded by the user's local midnights (timezone of their latest entry unless given)
+    user_timezone = user_timezone or latest_timezone(supabase, user_uuid)
+    
+    # Fetch only the period's rows from the "mood_entries" table, the date window is filtered on the server
+    df = load_frame(supabase, SUPABASE_DB, ['id', 'date', 'mood', 'description', 'timezone'],
+                    window_filters(user_uuid, period, now, user_timezone),
+                    dtypes={'id': 'int64', 'mood': 'float64'})
+    
+    # Turn the stored UTC dates into each entry's local wall-clock time
+    df['date'] = local_times(parse_utc_dates(df['date'], df['timezone']), df['timezone'])
+
+    # Keep the date, mood and description columns and convert the DataFrame to a CSV string
+    csv_string = df[['date', 'mood', 'description']].to_csv(index=False)
     
     return csv_string
 
 
 # Function to extract mood analysis historical data from the database
 @traceable
-def fetch_mood_analysis_historical(user_uuid, period='all'):
-    # Initialize the Supabase client
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY)
-    
-    # Query the "mood_analysis" table for the user's historical data
-    response = supabase.table(SUPABASE_DB_MANALYSIS)\
-        .select('id','date, category, sub_category, impact, description')\
-        .eq('user_uuid', user_uuid)\
-        .execute()
+def fetch_mood_analysis_historical(user_uuid, period='all', supabase=None, now=None):
+    # Initialize the Supabase client (pass one in to query a local stand-in instead)
+    supabase = supabase or create_client(SUPABASE_URL, SUPABASE_API_KEY)
     
-    # Extract the data
-    data = response.data
-    
-    # Convert the data to a pandas DataFrame
-    df = pd.DataFrame(data)
+    # Query the "mood_analysis" table for the user's historical data, windowed on the server for 'daily' and 'weekly'
+    df = load_frame(supabase, SUPABASE_DB_MANALYSIS, ['id', 'date', 'category', 'sub_category', 'impact', 'description'],
+                    window_filters(user_uuid, period, now), dtypes={'id': 'int64'})
     
     if df.empty:
         print("No data found.")
@@ -175,21 +264,6 @@ def fetch_mood_analysis_historical(user_uuid, period='all'):
 
     # Convert the 'date' column to datetime
     df['date'] = pd.to_datetime(df['date']).dt.normalize()
-
-    if period == 'daily':
-        # Filter the DataFrame for the previous day
-        yesterday = pd.Timestamp.now().normalize() - pd.Timedelta(days=1)
-        df = df[df['date'] == yesterday]
-    
-    elif period == 'weekly':
-        # Find the start and end dates for the most recent full week (Monday to Sunday)
-        current_date = pd.Timestamp.now().normalize()
-        last_monday = current_date - pd.Timedelta(days=current_date.weekday())
-        start_of_last_full_week = last_monday - pd.Timedelta(weeks=1)
-        end_of_last_full_week = start_of_last_full_week + pd.Timedelta(days=6)
-        
-        # Filter the DataFrame for the last full week
-        df = df[(df['date'] >= start_of_last_full_week) & (df['date'] <= end_of_last_full_week)]
     
     # Sort the DataFrame by date
     df = df.sort_values(by='date').reset_index(drop=True)
@@ -214,12 +288,13 @@ def delete_manalysis_rows_from_supabase(user_uuid, ids_to_delete=None, trim=Fals
             
             print(f"Deleted row ID: {id_to_delete}")
 
+        unindex_rows(user_uuid, ids_to_delete)
 
     # Trim rows if requested
     if trim:
-        # Fetch all rows for the user
+        # Fetch the ids and dates of all rows for the user
         response = supabase.table(SUPABASE_DB_MANALYSIS) \
-            .select("id, date, category, sub_category, impact, description") \
+            .select("id, date") \
             .eq('user_uuid', user_uuid) \
             .execute()
 
@@ -253,6 +328,7 @@ def delete_manalysis_rows_from_supabase(user_uuid, ids_to_delete=None, trim=Fals
                 print(f"Trimmed row ID: {id_to_trim}")
 
 
+            unindex_rows(user_uuid, ids_to_trim)
             print(f"Deleted {rows_to_delete} oldest rows to maintain 100 rows.")
         else:
             print("No trimming required. Row count is within limit.")
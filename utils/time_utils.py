@@ -0,0 +1,59 @@
+# Third-party library imports
+import numpy as np
+import pandas as pd
+import pytz
+
+# Format mood entries were stored in before the switch to UTC: the user's local wall-clock time
+LEGACY_DATE_FORMAT = '%m/%d/%Y %H:%M'
+
+
+def to_timezone(tz_name):
+    """Look up a timezone by name, falling back to UTC for missing or unknown names."""
+    try:
+        return pytz.timezone(tz_name)
+    except Exception:
+        return pytz.utc
+
+
+def _by_timezone(timezones):
+    """Row labels grouped by timezone name, so conversions run once per zone instead of once per row.
+
+    Rows without a timezone are grouped under UTC, the zone to_timezone falls back to.
+    """
+    # Object dtype, since a categorical column can't take 'UTC' as a fill value unless it's already a category
+    timezones = timezones.astype(object).fillna('UTC')
+    return timezones.groupby(timezones, sort=False).groups.items()
+
+
+def local_times(dates, timezones):
+    """Convert tz-aware UTC timestamps to naive wall-clock times, each row in its own timezone."""
+    local = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    for tz_name, idx in _by_timezone(timezones):
+        local.loc[idx] = dates.loc[idx].dt.tz_convert(to_timezone(tz_name)).dt.tz_localize(None)
+    return local
+
+
+def localize_local_times(local, timezones):
+    """Convert naive wall-clock times to tz-aware UTC timestamps, each row in its own timezone."""
+    dates = pd.Series(pd.NaT, index=local.index, dtype='datetime64[ns, UTC]')
+    for tz_name, idx in _by_timezone(timezones):
+        # Ambiguous (DST fall-back) times resolve to standard time, skipped ones shift forward
+        dates.loc[idx] = local.loc[idx].dt.tz_localize(
+            to_timezone(tz_name), ambiguous=np.zeros(len(idx), dtype=bool), nonexistent='shift_forward'
+        ).dt.tz_convert('UTC')
+    return dates
+
+
+def parse_utc_dates(dates, timezones):
+    """Parse stored entry dates into tz-aware UTC timestamps.
+
+    Entries are stored as ISO-8601 with an offset and parse on the fast ISO path. Rows
+    still in the legacy local-time format (not yet migrated) are parsed with an explicit
+    format and localized with their own timezone column.
+    """
+    parsed = pd.to_datetime(dates, format='ISO8601', utc=True, errors='coerce')
+    legacy = parsed.isna() & dates.notna()
+    if legacy.any():
+        local = pd.to_datetime(dates[legacy], format=LEGACY_DATE_FORMAT)
+        parsed[legacy] = localize_local_times(local, timezones[legacy])
+    return parsed